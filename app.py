@@ -1,83 +1,124 @@
-from flask import Flask, render_template, request, url_for, redirect, g, request, jsonify
+from flask import Flask, render_template, request, url_for, redirect, g, request, jsonify, session, abort, make_response
 import sqlite3
 import os
 import secrets
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user      
-from werkzeug.security import generate_password_hash, check_password_hash  
 from datetime import datetime       
-import requests       
+import json
+
+import click
+
+import ippt
+import rollups
+from database import get_pool, migrate, select_in
+from assets import AssetManifest
+from avatar import AvatarRenderer, load_layer_manifest
+from cache import ByteLRUCache, TTLCache
+from metrics import Metrics
+from passwords import DEFAULT_METHOD, HasherBusy, PasswordHasher
+from scoring import COMPLETE, PENDING, ScoringWorker
+from workout_import import detect_format, import_workouts, parse_workout_file, summarize as summarize_import
+from items import (
+    AVATAR_WIDTHS,
+    COMBINATION_BY_PATH,
+    SHOP_ITEMS,
+    SHOP_ITEM_ORDER,
+    SHOP_ITEM_CATEGORIES,
+    add_item,
+    avatar_path_for_items,
+    avatar_srcset_for_items,
+    equip_item,
+    keys_from_mask,
+    mask_from_keys,
+    normalize_item_key,
+    normalize_item_keys,
+)
+from ippt_client import IPPTClient, IPPTUnavailable
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("FLASK_SECRET_KEY") or secrets.token_hex(32)
 
-DATABASE = "database.db"
-
-SHOP_ITEMS = [
-    {
-        "key": "headband",
-        "name": "Headband",
-        "desc": "Keeps sweat off",
-        "price": 50,
-        "category": "accessory",
-        "preview_image": "images/shop/items/headband.png",
-    },
-    {
-        "key": "headphones",
-        "name": "Headphones",
-        "desc": "Workout soundtrack",
-        "price": 180,
-        "category": "accessory",
-        "preview_image": "images/shop/items/headphones.png",
-    },
-    {
-        "key": "wristband",
-        "name": "Wristband",
-        "desc": "Grip & comfort",
-        "price": 60,
-        "category": "accessory",
-        "preview_image": "images/shop/items/wristband.png",
-    },
-    {
-        "key": "watch",
-        "name": "Sports Watch",
-        "desc": "Track your runs",
-        "price": 220,
-        "category": "accessory",
-        "preview_image": "images/shop/items/watch.png",
-    },
-    {
-        "key": "nikeshirt",
-        "name": "Nike T-Shirt",
-        "desc": "Classic training fit",
-        "price": 140,
-        "category": "top",
-        "preview_image": "images/shop/items/nikeshirt.png",
-    },
-    {
-        "key": "nikesinglet",
-        "name": "Nike Singlet",
-        "desc": "Light & breathable",
-        "price": 130,
-        "category": "top",
-        "preview_image": "images/shop/items/nikesinglet.png",
-    },
-]
-
-SHOP_ITEM_ORDER = [item["key"] for item in SHOP_ITEMS]
-SHOP_ITEM_BY_KEY = {item["key"]: item for item in SHOP_ITEMS}
-SHOP_ITEM_CATEGORIES = {item["key"]: item["category"] for item in SHOP_ITEMS}
-TOP_ITEM_KEYS = {
-    item["key"] for item in SHOP_ITEMS if item["category"] == "top"
-}
-ITEM_KEY_ALIASES = {
-    "headband": "headband",
-    "headphones": "headphones",
-    "headphone": "headphones",
-    "wristband": "wristband",
-    "watch": "watch",
-    "nikeshirt": "nikeshirt",
-    "nikesinglet": "nikesinglet",
+DATABASE = os.environ.get("DATABASE_PATH", "database.db")
+
+# Workouts are scored with the tables in ippt.py once they are verified
+# against the official ones (ippt.TABLES_VERIFIED). Until then the IPPT API's
+# total is the only score that is saved: when the API cannot be reached,
+# workouts stay pending instead of getting a score from the unverified tables.
+# IPPT_REMOTE_SCORING=0 forces the local tables (offline development only).
+app.config["IPPT_REMOTE_SCORING"] = os.environ.get(
+    "IPPT_REMOTE_SCORING", "0" if ippt.TABLES_VERIFIED else "1"
+) != "0"
+ippt_client = IPPTClient(os.environ.get("IPPT_API_URL", ippt.IPPT_API_URL))
+
+# Workouts are queued and scored by a background worker; set ASYNC_SCORING=0
+# to score them inside the request instead.
+app.config["ASYNC_SCORING"] = os.environ.get("ASYNC_SCORING", "1") != "0"
+
+# Usernames allowed to POST unit results to /workout/import; the
+# `flask import-workouts` command is for whoever runs the server.
+app.config["WORKOUT_IMPORTERS"] = {
+    name.strip() for name in os.environ.get("WORKOUT_IMPORTERS", "").split(",") if name.strip()
 }
+app.config["WORKOUT_IMPORT_MAX_ROWS"] = int(os.environ.get("WORKOUT_IMPORT_MAX_ROWS", 10000))
+# While the IPPT API scores imports, the distinct rows of a file are sent
+# this many at a time, and the whole file must be scored within the budget.
+app.config["IPPT_IMPORT_CONCURRENCY"] = int(os.environ.get("IPPT_IMPORT_CONCURRENCY", 8))
+app.config["IPPT_IMPORT_BUDGET"] = float(os.environ.get("IPPT_IMPORT_BUDGET", 20))
+
+app.config["LEADERBOARD_PAGE_SIZE"] = int(os.environ.get("LEADERBOARD_PAGE_SIZE", 20))
+app.config["LEADERBOARD_MAX_PAGE_SIZE"] = 100
+app.config["TRACKER_MAX_POINTS"] = int(os.environ.get("TRACKER_MAX_POINTS", 120))
+
+user_cache = TTLCache(
+    maxsize=int(os.environ.get("USER_CACHE_SIZE", 1024)),
+    ttl=float(os.environ.get("USER_CACHE_TTL", 300)),
+)
+summary_cache = TTLCache(
+    maxsize=int(os.environ.get("SUMMARY_CACHE_SIZE", 1024)),
+    ttl=float(os.environ.get("SUMMARY_CACHE_TTL", 60)),
+)
+
+# Combinations missing from static/avatar/combinations are rendered on
+# request, kept in a byte-bounded LRU and optionally spilled to disk.
+avatar_renderer = AvatarRenderer(
+    prerendered_dir=os.path.join(app.static_folder, "avatar", "combinations"),
+    memory_cache=ByteLRUCache(int(os.environ.get("AVATAR_CACHE_BYTES", 32 * 1024 * 1024))),
+    disk_cache_dir=os.environ.get("AVATAR_DISK_CACHE_DIR") or None,
+)
+
+# Base image and per-item sprites for stacking the avatar in the browser,
+# exported by scripts/generate_avatar_combinations.py. Without the manifest the
+# templates fall back to the flattened combination images.
+avatar_layers = load_layer_manifest(os.path.join(app.static_folder, "avatar", "layers"))
+
+# Static URLs carry ?v=<content hash>; requests with the current hash are
+# cached by browsers for a year without revalidation.
+asset_manifest = AssetManifest(app.static_folder).build()
+STATIC_IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+# Set METRICS_ENABLED=1 for per-request timing, SQL statement counts and
+# IPPT call durations on /metrics, plus a log line for every slow request.
+metrics = None
+if os.environ.get("METRICS_ENABLED") == "1":
+    metrics = Metrics(slow_request_seconds=float(os.environ.get("SLOW_REQUEST_SECONDS", 0.5)))
+    metrics.init_app(app)
+    ippt_client.observer = metrics.observe_ippt
+
+# Password hashes are computed in a small process pool so login bursts do not
+# hold request threads; past the queue limit, /login and /register answer 503.
+password_hasher = PasswordHasher(
+    method=os.environ.get("PASSWORD_HASH_METHOD", DEFAULT_METHOD),
+    max_workers=int(os.environ.get("PASSWORD_HASH_WORKERS", 2)),
+    max_queue=int(os.environ.get("PASSWORD_HASH_QUEUE", 16)),
+    timeout=float(os.environ.get("PASSWORD_HASH_TIMEOUT", 10)),
+).start()
+
+@app.errorhandler(HasherBusy)
+def password_hasher_busy(exc):
+    app.logger.warning("Rejected sign-in: %s", exc)
+    response = make_response("The server is busy signing people in. Please try again in a moment.", 503)
+    response.headers["Retry-After"] = "2"
+    return response
 
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -90,148 +131,167 @@ class User(UserMixin):
 
 @login_manager.user_loader
 def load_user(user_id):
+    user_id = int(user_id)
+
+    # The username is stored in the signed session at login, so most requests
+    # can rebuild the user without touching the cache or the database.
+    username = session.get("username")
+    if username:
+        return User(user_id, username)
+
+    user = user_cache.get(user_id)
+    if user:
+        return user
+
     db = get_db()
-    user = db.execute(
-        "SELECT * FROM users WHERE id = ?",
+    row = db.execute(
+        "SELECT id, username FROM users WHERE id = ?",
         (user_id,)
     ).fetchone()
 
-    if user:
-        return User(user["id"], user["username"])
+    if row:
+        user = User(row["id"], row["username"])
+        user_cache.set(user_id, user)
+        return user
     return None
 
+def sign_in(user):
+    user_cache.set(user.id, user)
+    login_user(user)
+    session["username"] = user.username
+
 def get_db():
     db = getattr(g, "_database", None)
     if db is None:
-        db = g._database = sqlite3.connect(DATABASE)
-        db.row_factory = sqlite3.Row
-    return db
+        db = g._database = get_pool(DATABASE).acquire()
+        if metrics:
+            g._traced_database = metrics.trace(db)
+    return g._traced_database if metrics else db
+
+def level_for_xp(xp):
+    return (xp // 100) + 1
+
+def tier_for_score(score):
+    if score is None:
+        return "FAIL"
+    if score >= 85:
+        return "GOLD"
+    if score >= 65:
+        return "SILVER"
+    if score >= 51:
+        return "PASS"
+    return "FAIL"
+
+def build_summary(db, user_id):
+    # Reads only; returns None for users who have not completed onboarding.
+    profile = db.execute(
+        "SELECT xp, credits, owned_mask, equipped_mask FROM profiles WHERE user_id = ?",
+        (user_id,)
+    ).fetchone()
+    if not profile:
+        return None
 
-def item_keys_from_value(value):
-    if not value:
-        return []
-
-    raw_value = str(value).replace("\\", "/").lower()
-    if raw_value in SHOP_ITEM_BY_KEY:
-        return [raw_value]
-
-    filename = raw_value.rsplit("/", 1)[-1]
-    stem = filename.rsplit(".", 1)[0]
-    if "__" in stem:
-        return [
-            ITEM_KEY_ALIASES[item_key]
-            for item_key in stem.split("__")
-            if item_key in ITEM_KEY_ALIASES
-        ]
-
-    item_key = ITEM_KEY_ALIASES.get(stem)
-    return [item_key] if item_key else []
-
-def normalize_item_key(value):
-    keys = item_keys_from_value(value)
-    return keys[0] if keys else None
-
-def normalize_item_keys(values):
-    normalized = []
-    seen = set()
-    selected_top = None
-
-    for value in values or []:
-        for key in item_keys_from_value(value):
-            if not key:
-                continue
-
-            if key in TOP_ITEM_KEYS:
-                if selected_top and selected_top in seen:
-                    normalized = [item_key for item_key in normalized if item_key != selected_top]
-                    seen.remove(selected_top)
-                selected_top = key
-
-            if key not in seen:
-                normalized.append(key)
-                seen.add(key)
-
-    return [key for key in SHOP_ITEM_ORDER if key in seen]
-
-def avatar_filename_for_items(item_keys):
-    normalized = normalize_item_keys(item_keys)
-    if not normalized:
-        return "avatar/default.jpg"
-    return "avatar/combinations/" + "__".join(normalized) + ".png"
-
-def avatar_path_for_items(item_keys):
-    return "/static/" + avatar_filename_for_items(item_keys)
+    latest_workout = db.execute(
+        "SELECT pushup, situp, run, score FROM workout_tracking WHERE user_id = ? ORDER BY date_submitted DESC LIMIT 1",
+        (user_id,)
+    ).fetchone()
 
-@app.teardown_appcontext
-def close_connection(exception):
-    db = getattr(g, "_database", None)
-    if db is not None:
-        db.close()
+    owned_items = keys_from_mask(profile["owned_mask"] | profile["equipped_mask"])
+    equipped_items = keys_from_mask(profile["equipped_mask"])
+
+    xp = profile["xp"] or 0
+    summary = {
+        "xp": xp,
+        "level": level_for_xp(xp),
+        "tier": tier_for_score(latest_workout["score"] if latest_workout else None),
+        "latest_pushup": latest_workout["pushup"] if latest_workout else None,
+        "latest_situp": latest_workout["situp"] if latest_workout else None,
+        "latest_run": latest_workout["run"] if latest_workout else None,
+        "latest_score": latest_workout["score"] if latest_workout else None,
+        "credits": profile["credits"] or 0,
+        "owned_items": owned_items,
+        "equipped_items": equipped_items,
+        "avatar_path": avatar_path_for_items(equipped_items),
+    }
+    return summary
+
+def store_summary(db, user_id, summary, replace=True):
+    # With replace=False an existing row wins; returns whether this one was stored.
+    return db.execute(f"""
+        INSERT {"OR REPLACE " if replace else ""}INTO user_summary (
+            user_id, xp, level, tier, latest_pushup, latest_situp, latest_run,
+            latest_score, credits, owned_items, equipped_items, avatar_path
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        {"" if replace else "ON CONFLICT (user_id) DO NOTHING"}
+    """, (
+        user_id, summary["xp"], summary["level"], summary["tier"],
+        summary["latest_pushup"], summary["latest_situp"], summary["latest_run"],
+        summary["latest_score"], summary["credits"],
+        ",".join(summary["owned_items"]), ",".join(summary["equipped_items"]), summary["avatar_path"]
+    )).rowcount > 0
+
+def refresh_summary(db, user_id):
+    # Rebuilds the user's summary row inside the caller's transaction.
+    summary = build_summary(db, user_id)
+    if summary is None:
+        db.execute("DELETE FROM user_summary WHERE user_id = ?", (user_id,))
+    else:
+        store_summary(db, user_id, summary)
+    return summary
 
+def commit_with_summary(db, user_id):
+    summary = refresh_summary(db, user_id)
+    db.commit()
+    if summary:
+        summary_cache.set(user_id, summary)
+    else:
+        summary_cache.invalidate(user_id)
+    return summary
 
+def get_summary(user_id):
+    summary = summary_cache.get(user_id)
+    if summary:
+        return summary
 
-def create_tables():
     db = get_db()
-    cursor = db.cursor()
-
-     # Users table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL
-        )
-    """)
-     # PROFILES TABLE (one profile per user, use user_id as primary key)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS profiles (
-            user_id INTEGER PRIMARY KEY,
-            xp INTEGER DEFAULT 0,
-            credits INTEGER DEFAULT 0,
-            dob DATE,
-            goal TEXT,
-            avatar_path TEXT DEFAULT '/static/avatar/default.jpg',
-            next_ippt_date DATE,
-            prev_ippt_score INTEGER,
-            FOREIGN KEY(user_id) REFERENCES users(id)
-        )
-    """)
-    
-    # WORKOUT TRACKING TABLE (multiple submissions per user)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS workout_tracking (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            pushup INTEGER,
-            situp INTEGER,
-            run INTEGER,
-            score INTEGER,
-            date_submitted DATE,
-            FOREIGN KEY(user_id) REFERENCES users(id)
-        )
-    """)
-    #ITEMS OWNED TABLES
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS owned_items (
-        user_id INTEGER,
-        item_path TEXT,
-        PRIMARY KEY (user_id, item_path),
-        FOREIGN KEY(user_id) REFERENCES users(id)
-        )
-    """)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS equipped_items (
-        user_id INTEGER,
-        item_path TEXT,
-        PRIMARY KEY (user_id, item_path),
-        FOREIGN KEY(user_id) REFERENCES users(id)
-        )
-    """)
+    row = db.execute(
+        "SELECT * FROM user_summary WHERE user_id = ?", (user_id,)
+    ).fetchone()
+    if not row:
+        # Users created before the summary table existed get theirs built
+        # lazily; a user without a profile has nothing to store, so reads
+        # never write for them.
+        summary = build_summary(db, user_id)
+        if summary is None:
+            return None
+        # Built from reads outside a transaction, so it must not overwrite a
+        # summary a write committed in the meantime; that one is newer.
+        stored = store_summary(db, user_id, summary, replace=False)
+        db.commit()
+        if stored:
+            summary_cache.set(user_id, summary)
+            return summary
+        row = db.execute(
+            "SELECT * FROM user_summary WHERE user_id = ?", (user_id,)
+        ).fetchone()
 
-    
+    summary = dict(row)
+    del summary["user_id"]
+    summary["owned_items"] = [key for key in row["owned_items"].split(",") if key]
+    summary["equipped_items"] = [key for key in row["equipped_items"].split(",") if key]
+    summary_cache.set(user_id, summary)
+    return summary
 
+@app.teardown_appcontext
+def close_connection(exception):
+    db = g.pop("_database", None)
+    if db is not None:
+        if metrics:
+            g.pop("_traced_database", None)
+            metrics.untrace(db)
+        get_pool(DATABASE).release(db)
 
-    db.commit()
 
 
 #ROUTES
@@ -254,50 +314,30 @@ def index():
 @app.route("/home")
 @login_required
 def home():
-    db = get_db()
-    
-    # Get profile info
-    profile = db.execute(
-        "SELECT xp, credits, avatar_path FROM profiles WHERE user_id = ?",
-        (current_user.id,)
-    ).fetchone()
-
-    # Get latest workout (most recent submission)
-    latest_workout = db.execute(
-        "SELECT pushup, situp, run, score FROM workout_tracking WHERE user_id = ? ORDER BY date_submitted DESC LIMIT 1",
-        (current_user.id,)
-    ).fetchone()
+    summary = get_summary(current_user.id)
 
     # Calculate level + progress (example: every 100 XP = next level)
-    xp = profile["xp"] if profile else 0
-    level = (xp // 100) + 1
+    xp = summary["xp"] if summary else 0
+    level = summary["level"] if summary else level_for_xp(0)
     xp_progress = xp % 100
     xp_need = 100
     xp_percent = int((xp_progress / xp_need) * 100)
 
     # Tier based on latest IPPT score
-    tier = "FAIL"
-    if latest_workout:
-        score = latest_workout["score"]
-        if score >= 85:
-            tier = "GOLD"
-        elif score >= 65:
-            tier = "SILVER"
-        elif score >= 51:
-            tier = "PASS"
-        else:
-            tier = "FAIL"
-        pushups = latest_workout["pushup"]
-        situps = latest_workout["situp"]
-        run_time = latest_workout["run"]
+    tier = summary["tier"] if summary else tier_for_score(None)
+    if summary and summary["latest_score"] is not None:
+        score = summary["latest_score"]
+        pushups = summary["latest_pushup"]
+        situps = summary["latest_situp"]
+        run_time = summary["latest_run"]
     else:
         score = 0
         pushups = 0
         situps = 0
         run_time = 0
 
-    avatar_url = profile["avatar_path"] if profile and profile["avatar_path"] else None
-    credits = profile["credits"] if profile else 0
+    avatar_url = summary["avatar_path"] if summary else None
+    credits = summary["credits"] if summary else 0
 
     run = format_time(run_time)
 
@@ -314,6 +354,9 @@ def home():
         situps=situps,
         run_time=run,
         avatar_url=avatar_url,
+        avatar_layers=avatar_layers if summary else None,
+        pending_workout=session.get("pending_workout"),
+        equipped_items=summary["equipped_items"] if summary else [],
         credits=credits
     )
 
@@ -322,13 +365,158 @@ def format_time(seconds):
     secs = seconds % 60
     return f"{minutes:02d}:{secs:02d}"
 
+def age_from_dob(dob_value):
+    dob = datetime.strptime(dob_value, "%Y-%m-%d")
+    today = datetime.today()
+    return today.year - dob.year
+
+def ippt_score(age, situp, pushup, run):
+    # Raises IPPTUnavailable when the API decides and cannot be reached.
+    if app.config["IPPT_REMOTE_SCORING"]:
+        return ippt_client.score(age, situp, pushup, run)
+    return ippt.score(age, situp, pushup, run)
+
+def ippt_score_many(ages, situps, pushups, runs):
+    if not app.config["IPPT_REMOTE_SCORING"]:
+        return ippt.score_many(ages, situps, pushups, runs)
+    # Concurrent, time-boxed API calls; any failure fails the whole batch, so
+    # an import never saves rows without their real score.
+    return ippt_client.score_many(
+        zip(ages, situps, pushups, runs),
+        max_workers=app.config["IPPT_IMPORT_CONCURRENCY"],
+        budget=app.config["IPPT_IMPORT_BUDGET"],
+    )
+
+def save_workout(db, user_id, pushup, situp, run, score, date_submitted, submission_id=None):
+    # One row per user and day. Each submission awards its score as XP, so a
+    # resubmission replaces the workout but adds to the row's xp. Queued
+    # submissions can finish out of order (parallel workers, retries), so the
+    # row remembers the newest submission it holds; direct writes store the
+    # newest queued id at the time, since anything queued so far is older.
+    # Callers hold the write lock, so the check and the write agree.
+    key = (user_id, date_submitted)
+    stored = rollups.stored_workouts(db, [key])
+    if key in stored and submission_id is not None and submission_id <= (stored[key] or 0):
+        # Older than the workout already stored: award its XP, keep the workout.
+        db.execute(
+            "UPDATE workout_tracking SET xp = xp + ? WHERE user_id = ? AND date_submitted = ?",
+            (score, user_id, date_submitted)
+        )
+    else:
+        db.execute(
+            """
+            INSERT INTO workout_tracking (user_id, pushup, situp, run, score, date_submitted, xp, submission_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, COALESCE(?, (SELECT MAX(id) FROM workout_submissions)))
+            ON CONFLICT (user_id, date_submitted) DO UPDATE SET
+                pushup = excluded.pushup,
+                situp = excluded.situp,
+                run = excluded.run,
+                score = excluded.score,
+                submission_id = excluded.submission_id,
+                xp = workout_tracking.xp + excluded.xp
+            """,
+            (user_id, pushup, situp, run, score, date_submitted, score, submission_id)
+        )
+    rollups.record_workouts(db, [(user_id, date_submitted, score, key not in stored)])
+
+def award_workout_xp(db, user_id, score):
+    profile = db.execute(
+    "SELECT xp FROM profiles WHERE user_id = ?",
+    (user_id,)
+    ).fetchone()
+
+    old_xp = profile["xp"]
+    old_level = (old_xp // 100) + 1
+
+    # 2️⃣ Calculate new XP & level
+    new_xp = old_xp + score
+    new_level = (new_xp // 100) + 1
+
+    # 3️⃣ Calculate credits earned
+    levels_gained = new_level - old_level
+    credits_earned = max(0, levels_gained * 10)
+
+    # 4️⃣ Update profile
+    db.execute(
+        """
+        UPDATE profiles
+        SET xp = ?, credits = credits + ?
+        WHERE user_id = ?
+        """,
+        (new_xp, credits_earned, user_id)
+    )
+
+def award_workout_xp_totals(db, xp_by_user):
+    # Bulk version of award_workout_xp: one update per user for the sum of
+    # their scores. Credits depend only on the levels crossed, so this pays
+    # the same as awarding each workout in turn.
+    user_ids = list(xp_by_user)
+    old_xp = {
+        row["user_id"]: row["xp"]
+        for row in select_in(db, "SELECT user_id, xp FROM profiles WHERE user_id IN ({values})", user_ids)
+    }
+
+    updates = []
+    for user_id, gained in xp_by_user.items():
+        new_xp = old_xp[user_id] + gained
+        credits_earned = max(0, (level_for_xp(new_xp) - level_for_xp(old_xp[user_id])) * 10)
+        updates.append((new_xp, credits_earned, user_id))
+    db.executemany(
+        """
+        UPDATE profiles
+        SET xp = ?, credits = credits + ?
+        WHERE user_id = ?
+        """,
+        updates
+    )
+    for user_id in user_ids:
+        refresh_summary(db, user_id)
+
+def run_workout_import(rows):
+    awarded = []
+
+    def award(db, xp_by_user):
+        award_workout_xp_totals(db, xp_by_user)
+        awarded.extend(xp_by_user)
+
+    report = import_workouts(get_db(), rows, award, ippt_score_many)
+    for user_id in awarded:
+        summary_cache.invalidate(user_id)
+    return summarize_import(report)
+
+def score_submission(db, submission):
+    dob_row = db.execute(
+        "SELECT dob FROM profiles WHERE user_id = ?", (submission["user_id"],)
+    ).fetchone()
+    age = age_from_dob(dob_row["dob"])
+    app.logger.debug("Scoring workout for age %s", age)
+    # IPPTUnavailable leaves the submission pending for the worker to retry.
+    return ippt_score(age, submission["situp"], submission["pushup"], submission["run"])
+
+def apply_submission(db, submission, score):
+    # Runs inside the scoring worker's write transaction.
+    save_workout(db, submission["user_id"], submission["pushup"], submission["situp"],
+                 submission["run"], score, submission["date_submitted"], submission["id"])
+    award_workout_xp(db, submission["user_id"], score)
+    refresh_summary(db, submission["user_id"])
+
+scoring_worker = ScoringWorker(
+    DATABASE,
+    score_submission,
+    apply_submission,
+    on_complete=summary_cache.invalidate,
+    max_workers=int(os.environ.get("SCORING_WORKERS", 2)),
+    max_attempts=int(os.environ.get("SCORING_MAX_ATTEMPTS", 5)),
+    transient=(IPPTUnavailable,),
+)
+
 @app.route("/register", methods=["GET", "POST"])
 def register():
     if request.method == "POST":
         username = request.form["username"]
         password = request.form["password"]
 
-        hashed_pw = generate_password_hash(password)
+        hashed_pw = password_hasher.hash(password)
 
         db = get_db()
         try:
@@ -343,7 +531,8 @@ def register():
                 (username,)
             ).fetchone()
 
-            login_user(User(user["id"], user["username"]))
+            user_cache.invalidate(user["id"])
+            sign_in(User(user["id"], user["username"]))
             return redirect(url_for("onboarding"))
         except sqlite3.IntegrityError:
             return "Username already exists"
@@ -362,9 +551,19 @@ def login_page():
             (username,)
         ).fetchone()
 
-        if user and check_password_hash(user["password"], password):
-            login_user(User(user["id"], user["username"]))
-            return redirect(url_for("home"))
+        if user:
+            valid, new_hash = password_hasher.verify(user["password"], password)
+            if valid:
+                if new_hash:
+                    # Upgrade to the configured hash parameters, unless the
+                    # password changed while we were checking it.
+                    db.execute(
+                        "UPDATE users SET password = ? WHERE id = ? AND password = ?",
+                        (new_hash, user["id"], user["password"])
+                    )
+                    db.commit()
+                sign_in(User(user["id"], user["username"]))
+                return redirect(url_for("home"))
 
         return "Invalid username or password"
 
@@ -373,7 +572,9 @@ def login_page():
 @app.route("/logout")
 @login_required
 def logout():
+    user_cache.invalidate(current_user.id)
     logout_user()
+    session.pop("username", None)
     return redirect(url_for("login_page"))
 
 # @app.route("/shop")
@@ -390,46 +591,22 @@ def logout():
 @app.route("/shop")
 @login_required
 def shop():
-    db = get_db()
-
-    profile = db.execute("""
-        SELECT credits, avatar_path
-        FROM profiles
-        WHERE user_id = ?
-    """, (current_user.id,)).fetchone()
-    if not profile:
+    summary = get_summary(current_user.id)
+    if not summary:
         return redirect(url_for("onboarding"))
 
-    owned = db.execute("""
-        SELECT item_path FROM owned_items
-        WHERE user_id = ?
-    """, (current_user.id,)).fetchall()
-
-    equipped = db.execute("""
-        SELECT item_path FROM equipped_items
-        WHERE user_id = ?
-    """, (current_user.id,)).fetchall()
-
-    owned_items = normalize_item_keys(row["item_path"] for row in owned)
-    equipped_items = normalize_item_keys(row["item_path"] for row in equipped)
-    if not equipped_items:
-        equipped_items = normalize_item_keys([profile["avatar_path"]])
-
-    for item_key in equipped_items:
-        if item_key not in owned_items:
-            owned_items.append(item_key)
-
-    avatar_path = avatar_path_for_items(equipped_items)
-
     return render_template(
         "shop.html",
-        credits=profile["credits"],
-        avatar_path=avatar_path,
-        owned_items=owned_items,
-        equipped_items=equipped_items,
+        credits=summary["credits"],
+        tier=summary["tier"],
+        avatar_path=summary["avatar_path"],
+        owned_items=summary["owned_items"],
+        equipped_items=summary["equipped_items"],
         shop_items=SHOP_ITEMS,
         item_order=SHOP_ITEM_ORDER,
-        item_categories=SHOP_ITEM_CATEGORIES
+        item_categories=SHOP_ITEM_CATEGORIES,
+        avatar_widths=AVATAR_WIDTHS,
+        avatar_layers=avatar_layers
     )
 
 
@@ -446,39 +623,26 @@ def save_shop():
 
     owned_items = normalize_item_keys(data.get("owned_items", []))
     equipped_items = normalize_item_keys(data.get("equipped_items", []))
-
-    for item_key in equipped_items:
-        if item_key not in owned_items:
-            owned_items.append(item_key)
+    equipped_mask = mask_from_keys(equipped_items)
+    owned_mask = mask_from_keys(owned_items) | equipped_mask
 
     avatar_path = avatar_path_for_items(equipped_items)
 
     db = get_db()
 
-    # Save credits + equipped avatar
+    # Save credits, inventory and equipped avatar in one row update
     db.execute("""
         UPDATE profiles
-        SET credits = ?, avatar_path = ?
+        SET credits = ?, avatar_path = ?, owned_mask = ?, equipped_mask = ?
         WHERE user_id = ?
-    """, (credits, avatar_path, current_user.id))
+    """, (credits, avatar_path, owned_mask, equipped_mask, current_user.id))
 
-    # Replace owned/equipped items
-    db.execute("DELETE FROM owned_items WHERE user_id = ?", (current_user.id,))
-    for item in owned_items:
-        db.execute("""
-            INSERT INTO owned_items (user_id, item_path)
-            VALUES (?, ?)
-        """, (current_user.id, item))
-
-    db.execute("DELETE FROM equipped_items WHERE user_id = ?", (current_user.id,))
-    for item in equipped_items:
-        db.execute("""
-            INSERT INTO equipped_items (user_id, item_path)
-            VALUES (?, ?)
-        """, (current_user.id, item))
-
-    db.commit()
-    return jsonify({"avatar_path": avatar_path}), 200
+    commit_with_summary(db, current_user.id)
+    return jsonify({
+        "avatar_path": avatar_path,
+        "avatar_url": asset_url(avatar_path),
+        "avatar_srcset": avatar_srcset(avatar_path),
+    }), 200
 
 
 
@@ -500,56 +664,181 @@ def purchase_items():
 
     # Get current credits
     row = db.execute(
-        "SELECT credits FROM profiles WHERE user_id = ?",
+        "SELECT credits, owned_mask, equipped_mask FROM profiles WHERE user_id = ?",
         (current_user.id,)
     ).fetchone()
 
     if not row or row["credits"] < price:
         return jsonify({"success": False, "message": "Insufficient Credits"}), 400
 
-    # Deduct credits
+    # Deduct credits, add the item to the inventory and equip it
     new_credits = row["credits"] - price
-    db.execute(
-        "UPDATE profiles SET credits = ? WHERE user_id = ?",
-        (new_credits, current_user.id)
-    )
+    owned_mask = add_item(row["owned_mask"], item_key)
+    equipped_mask = equip_item(row["equipped_mask"], item_key)
+    avatar_path = avatar_path_for_items(keys_from_mask(equipped_mask))
 
-    equipped = db.execute("""
-        SELECT item_path FROM equipped_items
+    db.execute("""
+        UPDATE profiles
+        SET credits = ?, owned_mask = ?, equipped_mask = ?, avatar_path = ?
         WHERE user_id = ?
-    """, (current_user.id,)).fetchall()
-    equipped_items = normalize_item_keys([row["item_path"] for row in equipped] + [item_key])
-    avatar_path = avatar_path_for_items(equipped_items)
+    """, (new_credits, owned_mask, equipped_mask, avatar_path, current_user.id))
 
-    db.execute("""
-        INSERT OR IGNORE INTO owned_items (user_id, item_path)
-        VALUES (?, ?)
-    """, (current_user.id, item_key))
+    commit_with_summary(db, current_user.id)
 
-    db.execute("DELETE FROM equipped_items WHERE user_id = ?", (current_user.id,))
-    for equipped_item in equipped_items:
-        db.execute("""
-            INSERT INTO equipped_items (user_id, item_path)
-            VALUES (?, ?)
-        """, (current_user.id, equipped_item))
+    return jsonify({"success": True, "credits": new_credits, "avatar_path": avatar_path})
 
-    db.execute(
-        "UPDATE profiles SET avatar_path = ? WHERE user_id = ?",
-        (avatar_path, current_user.id)
+@app.route("/static/avatar/combinations/<name>.png")
+def avatar_combination(name):
+    combo = COMBINATION_BY_PATH.get(name)
+    if not combo:
+        abort(404)
+
+    # Pre-rendered files still win when they exist.
+    if os.path.exists(os.path.join(app.static_folder, combo.filename)):
+        return app.send_static_file(combo.filename)
+
+    return rendered_avatar_response(combo.keys)
+
+@app.route("/static/avatar/combinations/<name>-<int:width>.webp")
+def avatar_combination_variant(name, width):
+    combo = COMBINATION_BY_PATH.get(name)
+    if not combo or width not in AVATAR_WIDTHS:
+        abort(404)
+
+    filename = f"avatar/combinations/{name}-{width}.webp"
+    if os.path.exists(os.path.join(app.static_folder, filename)):
+        return app.send_static_file(filename)
+
+    return rendered_avatar_response(combo.keys, width)
+
+def rendered_avatar_response(keys, width=None):
+    try:
+        image_bytes, etag = avatar_renderer.render(keys, width)
+    except FileNotFoundError:
+        abort(404)
+
+    response = make_response(image_bytes)
+    response.mimetype = "image/webp" if width else "image/png"
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = 86400
+    return response.make_conditional(request)
+
+@app.template_global()
+def asset_url(path):
+    # Fingerprints a literal "/static/..." URL, e.g. a stored avatar path.
+    prefix = app.static_url_path + "/"
+    if not path or not path.startswith(prefix) or "?" in path:
+        return path
+    version = asset_manifest.version(path[len(prefix):])
+    return f"{path}?v={version}" if version else path
+
+@app.template_global()
+def avatar_srcset(avatar_path):
+    srcset = avatar_srcset_for_items([avatar_path])
+    return ", ".join(
+        f"{asset_url(url)} {width}"
+        for url, width in (entry.rsplit(" ", 1) for entry in srcset.split(", ") if entry)
     )
 
-    db.commit()
+@app.url_defaults
+def fingerprint_static_urls(endpoint, values):
+    if endpoint == "static" and "filename" in values and "v" not in values:
+        version = asset_manifest.version(values["filename"])
+        if version:
+            values["v"] = version
+
+@app.after_request
+def cache_fingerprinted_assets(response):
+    version = request.args.get("v")
+    prefix = app.static_url_path + "/"
+    if not version or not request.path.startswith(prefix) or response.status_code not in (200, 304):
+        return response
+    if asset_manifest.version(request.path[len(prefix):]) != version:
+        return response
+
+    response.cache_control.no_cache = None
+    response.cache_control.public = True
+    response.cache_control.max_age = STATIC_IMMUTABLE_MAX_AGE
+    response.cache_control.immutable = True
+    response.set_etag(version)
+    return response.make_conditional(request)
+
+TRACKER_BUCKETS = {
+    "day": "date_submitted",
+    "week": "strftime('%Y-W%W', date_submitted)",
+    "month": "strftime('%Y-%m', date_submitted)",
+}
 
-    return jsonify({"success": True, "credits": new_credits, "avatar_path": avatar_path})
+def downsample_lttb(labels, values, threshold):
+    # Largest-Triangle-Three-Buckets: keeps the visual shape of the series
+    # with at most `threshold` points, always including the first and last.
+    count = len(values)
+    if threshold >= count or threshold < 3:
+        return labels, values
+
+    sampled = [0]
+    bucket_size = (count - 2) / (threshold - 2)
+    previous = 0
+
+    for bucket in range(threshold - 2):
+        start = int(bucket * bucket_size) + 1
+        end = int((bucket + 1) * bucket_size) + 1
+
+        next_start = end
+        next_end = min(int((bucket + 2) * bucket_size) + 1, count)
+        next_span = range(next_start, next_end) if next_end > next_start else range(count - 1, count)
+        avg_x = sum(next_span) / len(next_span)
+        avg_y = sum(values[index] for index in next_span) / len(next_span)
+
+        best_index = start
+        best_area = -1
+        for index in range(start, end):
+            area = abs(
+                (previous - avg_x) * (values[index] - values[previous])
+                - (previous - index) * (avg_y - values[previous])
+            )
+            if area > best_area:
+                best_area = area
+                best_index = index
+
+        sampled.append(best_index)
+        previous = best_index
+
+    sampled.append(count - 1)
+    return [labels[index] for index in sampled], [values[index] for index in sampled]
 
 @app.route("/tracker")
 @login_required
 def tracker():
+    bucket = request.args.get("bucket", "day")
+    if bucket not in TRACKER_BUCKETS:
+        bucket = "day"
+
+    max_points = app.config["TRACKER_MAX_POINTS"]
+    points = request.args.get("points", type=int)
+    if points:
+        max_points = min(max(points, 3), max_points)
+
     db = get_db()
-    results = db.execute("SELECT date_submitted, score FROM workout_tracking ORDER BY date_submitted").fetchall()
-    dates = [row[0] for row in results]
-    scores = [row[1] for row in results]
-    return render_template("tracker.html", dates=dates, scores=scores)
+    label = TRACKER_BUCKETS[bucket]
+    results = db.execute(f"""
+        SELECT {label} AS label, ROUND(AVG(score)) AS score
+        FROM workout_tracking
+        WHERE user_id = ?
+        GROUP BY label
+        ORDER BY label
+    """, (current_user.id,)).fetchall()
+    dates = [row["label"] for row in results]
+    scores = [int(row["score"]) for row in results]
+    dates, scores = downsample_lttb(dates, scores, max_points)
+    return render_template(
+        "tracker.html",
+        dates=dates,
+        scores=scores,
+        bucket=bucket,
+        buckets=list(TRACKER_BUCKETS)
+    )
 
 
 @app.route("/workout", methods=["GET", "POST"])
@@ -562,74 +851,151 @@ def workout():
         run_min = int(request.form["run_min"]) 
         run_sec = int(request.form["run_sec"])
         run = (run_min* 60) + run_sec
-        dob_row = db.execute(
-            "SELECT dob FROM profiles WHERE user_id = ?", (current_user.id,)
-        ).fetchone()
-        dob = datetime.strptime(dob_row["dob"], "%Y-%m-%d")
-        today = datetime.today()
-        age = today.year - dob.year
-        print(age)
-        response = requests.get(
-            f"https://ippt.vercel.app/api?age={age}&situps={situp}&pushups={pushup}&run={run}"
-        )
-        # return f"Response: {response.status_code}, {response.json().get('total')}, {situp}, {pushup}, {run}"
-        if response.status_code == 200:
-            score = response.json().get('total')
-        else:
-            return f"Error fetching IPPT score: {response.status_code}, {age}, {response}"
 
         today = datetime.now()           # full datetime
         today_str = today.strftime("%Y-%m-%d")
 
-        db.execute(
-            """
-            DELETE FROM workout_tracking
-            WHERE user_id = ? AND date_submitted = ?
-            """,
-            (current_user.id, today_str)
-        )
-
-        db.execute(
-            """
-            INSERT INTO workout_tracking (user_id, pushup, situp, run, score, date_submitted)
-            VALUES (?, ?, ?, ?, ?, ?)
-            """,
-            # (current_user.id, pushup, situp, run, score, "2025-10-17") #to replace with below
-            (current_user.id, pushup, situp, run, score, today_str)
-        )
-
-        profile = db.execute(
-        "SELECT xp FROM profiles WHERE user_id = ?",
-        (current_user.id,)
-        ).fetchone()
-
-        old_xp = profile["xp"]
-        old_level = (old_xp // 100) + 1
+        # Store the raw entry and return; scoring, XP and credits happen in
+        # the scoring worker and the home page polls /workout/status.
+        submission_id = scoring_worker.enqueue(db, current_user.id, pushup, situp, run, today_str)
+        db.commit()
 
-        # 2️⃣ Calculate new XP & level
-        new_xp = old_xp + score
-        new_level = (new_xp // 100) + 1
+        if app.config["ASYNC_SCORING"]:
+            session["pending_workout"] = submission_id
+            scoring_worker.notify()
+        else:
+            # On the request's connection, so its SQL shows up in the metrics.
+            status = scoring_worker.process(submission_id, db)
+            if status != COMPLETE:
+                # Show it on the home page like a queued workout, and let the
+                # worker retry it if it is still pending.
+                session["pending_workout"] = submission_id
+                if status == PENDING:
+                    scoring_worker.notify()
+        return redirect(url_for("home"))
+          # or redirect somewhere
 
-        # 3️⃣ Calculate credits earned
-        levels_gained = new_level - old_level
-        credits_earned = max(0, levels_gained * 10)
+    return render_template("workout.html")
 
-        # 4️⃣ Update profile
-        db.execute(
-            """
-            UPDATE profiles
-            SET xp = ?, credits = credits + ?
+@app.route("/workout/status")
+@login_required
+def workout_status():
+    db = get_db()
+    submission_id = request.args.get("id", type=int)
+    if submission_id is None:
+        rows = db.execute("""
+            SELECT id, status, score, date_submitted, attempts, error
+            FROM workout_submissions
             WHERE user_id = ?
-            """,
-            (new_xp, credits_earned, current_user.id)
-        )
+            ORDER BY id DESC
+            LIMIT 5
+        """, (current_user.id,)).fetchall()
+    else:
+        rows = db.execute("""
+            SELECT id, status, score, date_submitted, attempts, error
+            FROM workout_submissions
+            WHERE user_id = ? AND id = ?
+        """, (current_user.id, submission_id)).fetchall()
+        if not rows:
+            abort(404)
+
+    submissions = [dict(row) for row in rows]
+    pending = [row["id"] for row in submissions if row["status"] == PENDING]
+    if pending:
+        # Also resumes entries left queued by a restart.
+        scoring_worker.notify()
+    elif session.get("pending_workout") in [row["id"] for row in submissions]:
+        session.pop("pending_workout")
+
+    return jsonify({"pending": len(pending), "submissions": submissions})
+
+@app.route("/workout/import", methods=["POST"])
+@login_required
+def workout_import():
+    if current_user.username not in app.config["WORKOUT_IMPORTERS"]:
+        abort(403)
+
+    upload = request.files.get("file")
+    if upload:
+        data = upload.read()
+        format = request.form.get("format") or detect_format(upload.filename, upload.mimetype)
+    else:
+        data = request.get_data()
+        format = request.args.get("format") or detect_format(mimetype=request.mimetype)
 
+    try:
+        rows = parse_workout_file(data, format)
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+    if len(rows) > app.config["WORKOUT_IMPORT_MAX_ROWS"]:
+        return jsonify({"error": f"At most {app.config['WORKOUT_IMPORT_MAX_ROWS']} rows per import"}), 413
 
-        db.commit()
-        return redirect(url_for("home"))
-          # or redirect somewhere
+    try:
+        result = run_workout_import(rows)
+    except IPPTUnavailable as exc:
+        app.logger.warning("IPPT API unavailable, rejecting the import: %s", exc)
+        return jsonify({"error": "IPPT scoring is unavailable; nothing was imported, try again later"}), 503
+    return jsonify(result)
+
+@app.cli.command("import-workouts")
+@click.argument("path", type=click.File("rb"))
+@click.option("--format", type=click.Choice(["csv", "json"]), help="Defaults to the file extension.")
+@click.option("--report", type=click.File("w"), help="Write the per-row report as JSON.")
+def import_workouts_command(path, format, report):
+    """Import a unit's workout results (username, date, pushups, situps, run)."""
+    format = format or detect_format(path.name)
+    try:
+        rows = parse_workout_file(path.read(), format)
+    except ValueError as exc:
+        raise click.ClickException(str(exc))
 
-    return render_template("workout.html")
+    try:
+        result = run_workout_import(rows)
+    except IPPTUnavailable as exc:
+        raise click.ClickException(f"IPPT scoring is unavailable; nothing was imported: {exc}")
+    if report:
+        json.dump(result, report, indent=2)
+    for entry in result["rows"]:
+        if entry["status"] != "imported":
+            click.echo(f"row {entry['row']} ({entry.get('username', '?')}): {entry['error']}", err=True)
+    click.echo(f"Imported {result['imported']} workouts for {result['users']} users; {result['failed']} rows failed.")
+    if result["failed"]:
+        raise SystemExit(1)
+
+@app.cli.command("record-ippt-answers")
+@click.option("--output", type=click.Path(dir_okay=False), default=ippt.RECORDED_ANSWERS, show_default=True)
+@click.option("--age", "ages", type=int, multiple=True, help="Ages to sweep (default: both sides of every age band).")
+def record_ippt_answers_command(output, ages):
+    """Record the IPPT API's totals for every table entry, to check ippt.py against."""
+    answers = []
+    inputs = list(ippt.sweep_inputs(ages or None))
+    with click.progressbar(inputs, label="Querying the IPPT API") as bar:
+        for age, situps, pushups, run in bar:
+            try:
+                total = ippt_client.score(age, situps, pushups, run)
+            except IPPTUnavailable as exc:
+                raise click.ClickException(f"IPPT API failed for age={age} situps={situps} pushups={pushups} run={run}: {exc}")
+            answers.append([age, situps, pushups, run, total])
+
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as handle:
+        json.dump({"api_url": ippt_client.base_url, "answers": answers}, handle)
+    mismatches = sum(1 for *key, total in answers if ippt.score(*key) != total)
+    click.echo(f"Recorded {len(answers)} answers to {output}; the local tables disagree on {mismatches}.")
+
+@app.cli.command("rebuild-rollups")
+def rebuild_rollups_command():
+    """Recompute the day/week/month XP rollups from workout_tracking."""
+    db = get_db()
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        rollups.rebuild(db)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    count = db.execute("SELECT COUNT(*) FROM workout_rollups").fetchone()[0]
+    click.echo(f"Rebuilt {count} rollup rows.")
 
 @app.route("/setworkout", methods=["GET", "POST"])
 @login_required
@@ -642,50 +1008,43 @@ def setworkout():
         dob_row = db.execute(
             "SELECT dob FROM profiles WHERE user_id = ?", (current_user.id,)
         ).fetchone()
-        dob = datetime.strptime(dob_row["dob"], "%Y-%m-%d")
-        today = datetime.today()
-        age = today.year - dob.year
-        print(age)
-        response = requests.get(
-            f"https://ippt.vercel.app/api?age={age}&situps={situp}&pushups={pushup}&run={run}"
-        )
-        # return f"Response: {response.status_code}, {response.json().get('total')}, {situp}, {pushup}, {run}"
-        if response.status_code == 200:
-            score = response.json().get('total')
-        else:
-            return f"Error fetching IPPT score: {response.status_code}, {age}, {response}"
-        
+        age = age_from_dob(dob_row["dob"])
+        app.logger.debug("Scoring workout for age %s", age)
         today = datetime.now()           # full datetime
         today_str = today.strftime("%Y-%m-%d")
+        try:
+            score = ippt_score(age, situp, pushup, run)
+        except IPPTUnavailable as exc:
+            # No score to save yet: queue it for the scoring worker, which
+            # retries until the API answers.
+            app.logger.warning("IPPT API unavailable, queueing the workout: %s", exc)
+            session["pending_workout"] = scoring_worker.enqueue(
+                db, current_user.id, pushup, situp, run, today_str
+            )
+            db.commit()
+            scoring_worker.notify()
+            return redirect(url_for("home"))
 
-        db.execute(
-            """
-            DELETE FROM workout_tracking
-            WHERE user_id = ? AND date_submitted = ?
-            """,
-            (current_user.id, today_str)
-        )
-
-        db.execute(
-            """
-            INSERT INTO workout_tracking (user_id, pushup, situp, run, score, date_submitted)
-            VALUES (?, ?, ?, ?, ?, ?)
-            """,
-            # (current_user.id, pushup, situp, run, score, "2025-10-17") #to replace with below
-            (current_user.id, pushup, situp, run, score, today_str)
-        )
+        # Take the write lock before save_workout() checks for today's row, so
+        # a concurrent submission cannot count it as new as well.
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            save_workout(db, current_user.id, pushup, situp, run, score, today_str)
 
-        db.execute(
-            """
-            UPDATE profiles 
-            SET xp = xp + ?
-            WHERE user_id = ?
-            """,
-            # (current_user.id, pushup, situp, run, score, "2025-10-17") #to replace with below
-            (score, current_user.id)
-        )
+            db.execute(
+                """
+                UPDATE profiles 
+                SET xp = xp + ?
+                WHERE user_id = ?
+                """,
+                # (current_user.id, pushup, situp, run, score, "2025-10-17") #to replace with below
+                (score, current_user.id)
+            )
 
-        db.commit()
+            commit_with_summary(db, current_user.id)
+        except Exception:
+            db.rollback()
+            raise
         #   # or redirect somewhere
    
     return render_template("setworkout.html")
@@ -708,7 +1067,7 @@ def onboarding():
                 """,
                 (current_user.id, dob, next_ippt_date, prev_ippt_score, goal)
             )
-            db.commit()
+            commit_with_summary(db, current_user.id)
             return redirect(url_for("home"))
         except sqlite3.IntegrityError:
             # If the profile already exists, you could update it instead
@@ -720,23 +1079,100 @@ def onboarding():
                 """,
                 (dob, next_ippt_date, prev_ippt_score, goal, current_user.id)
             )
-            db.commit()
+            commit_with_summary(db, current_user.id)
             return redirect(url_for("home"))
 
     return render_template("onboarding.html")
 
+def parse_leaderboard_cursor(value):
+    # Cursor format: "<xp>:<user_id>:<rank>" of the last row on the previous page.
+    if not value:
+        return None
+    try:
+        xp, user_id, rank = (int(part) for part in value.split(":"))
+    except ValueError:
+        return None
+    return xp, user_id, rank
+
+LEADERBOARD_WINDOWS = ("all", "month", "week")
+
+def leaderboard_window(value):
+    return value if value in LEADERBOARD_WINDOWS else "all"
+
+def leaderboard_page(after=None, limit=None, window="all"):
+    page_size = app.config["LEADERBOARD_PAGE_SIZE"]
+    if limit is not None:
+        page_size = min(max(limit, 1), app.config["LEADERBOARD_MAX_PAGE_SIZE"])
+
+    # All-time ranks by profile XP; week and month read the current period's
+    # slice of workout_rollups through its (grain, period, xp, user_id) index.
+    if window == "all":
+        source, conditions, params = "profiles", [], []
+    else:
+        period = rollups.period_starts(datetime.now().date())[window]
+        source = "workout_rollups"
+        conditions, params = ["workout_rollups.grain = ?", "workout_rollups.period = ?"], [window, period]
+
+    if after:
+        after_xp, after_user_id, rank_offset = after
+        conditions.append(f"{source}.xp <= ? AND ({source}.xp < ? OR {source}.user_id > ?)")
+        params += [after_xp, after_xp, after_user_id]
+    else:
+        rank_offset = 0
+
+    db = get_db()
+    rows = db.execute(f"""
+        SELECT users.username, {source}.xp, {source}.user_id
+        FROM {source}
+        JOIN users ON {source}.user_id = users.id
+        {"WHERE " + " AND ".join(conditions) if conditions else ""}
+        ORDER BY {source}.xp DESC, {source}.user_id
+        LIMIT ?
+    """, (*params, page_size + 1)).fetchall()
+
+    # One extra row tells us whether another page exists without a COUNT(*).
+    users_points = rows[:page_size]
+    next_cursor = None
+    if len(rows) > page_size:
+        last = users_points[-1]
+        next_cursor = f"{last['xp']}:{last['user_id']}:{rank_offset + len(users_points)}"
+
+    return users_points, rank_offset, next_cursor
+
 @app.route("/leaderboard")
 def leaderboard():
-    db = get_db()
-    # Get all users and points, sorted descending
-    users_points = db.execute("""
-        SELECT users.username, profiles.xp
-        FROM profiles
-        JOIN users ON profiles.user_id = users.id
-        ORDER BY profiles.xp DESC
-    """).fetchall()
+    after = parse_leaderboard_cursor(request.args.get("after"))
+    window = leaderboard_window(request.args.get("window"))
+    users_points, rank_offset, next_cursor = leaderboard_page(
+        after, request.args.get("limit", type=int), window
+    )
+
+    return render_template(
+        "leaderboard.html",
+        users_points=users_points,
+        rank_offset=rank_offset,
+        next_cursor=next_cursor,
+        is_first_page=after is None,
+        window=window,
+        windows=LEADERBOARD_WINDOWS
+    )
+
+@app.route("/api/leaderboard")
+def leaderboard_json():
+    after = parse_leaderboard_cursor(request.args.get("after"))
+    window = leaderboard_window(request.args.get("window"))
+    users_points, rank_offset, next_cursor = leaderboard_page(
+        after, request.args.get("limit", type=int), window
+    )
 
-    return render_template("leaderboard.html", users_points=users_points)
+    return jsonify({
+        "window": window,
+        "users": [
+            {"rank": rank_offset + index, "username": row["username"], "xp": row["xp"]}
+            for index, row in enumerate(users_points, start=1)
+        ],
+        "next": next_cursor
+    })
 
 
 @app.route("/profile", methods=["GET", "POST"])
@@ -768,7 +1204,7 @@ def profile():
     return render_template("profile.html", user=user)
 
 with app.app_context():
-    create_tables()
+    migrate(get_db())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,55 @@
+import hashlib
+import os
+import threading
+
+
+class AssetManifest:
+    """Content-hash fingerprints for files under the static folder.
+
+    Hashes are computed once per file and recomputed only when the file's
+    mtime or size changes, so regenerated assets get a new URL without a
+    restart.
+    """
+
+    def __init__(self, static_folder, digest_size=12):
+        self.static_folder = static_folder
+        self.digest_size = digest_size
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def build(self):
+        for directory, _, filenames in os.walk(self.static_folder):
+            for name in filenames:
+                path = os.path.join(directory, name)
+                self.version(os.path.relpath(path, self.static_folder).replace(os.sep, "/"))
+        return self
+
+    def version(self, filename):
+        path = os.path.normpath(os.path.join(self.static_folder, filename))
+        if not path.startswith(os.path.join(self.static_folder, "")):
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if not os.path.isfile(path):
+            return None
+
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._versions.get(filename)
+            if cached and cached[0] == stamp:
+                return cached[1]
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as handle:
+            for chunk in iter(lambda: handle.read(1024 * 1024), b""):
+                digest.update(chunk)
+        version = digest.hexdigest()[:self.digest_size]
+
+        with self._lock:
+            self._versions[filename] = (stamp, version)
+        return version
+
+    def __len__(self):
+        return len(self._versions)
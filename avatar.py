@@ -0,0 +1,425 @@
+"""Avatar image pipeline shared by the app and the combination generator.
+
+Item masks are extracted by diffing each item's source image against the
+base avatar, then cropped to their bounding box so combinations can be
+composited from small layers.
+"""
+
+import hashlib
+import json
+import threading
+from io import BytesIO
+from pathlib import Path
+
+from PIL import Image, ImageChops, ImageFilter
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - the pure Python path below still works
+    np = None
+
+
+AVATAR_DIR = Path(__file__).resolve().parent / "static" / "avatar"
+LAYERS_DIR = AVATAR_DIR / "layers"
+LAYER_MANIFEST_NAME = "manifest.json"
+
+# Bump when the mask or compositing code changes output for the same inputs,
+# so the next run rebuilds every combination.
+RENDER_VERSION = 2
+WEBP_QUALITY = 82
+
+LAYER_ORDER = [
+    "nikeshirt",
+    "nikesinglet",
+    "headband",
+    "headphones",
+    "wristband",
+    "watch",
+]
+
+ITEMS = {
+    "headband": {
+        "source": "headband.png",
+        "threshold": 55,
+        "focus": (430, 50, 590, 155),
+        "min_area": 20,
+    },
+    "headphones": {
+        "source": "headphone.png",
+        "threshold": 55,
+        "focus": (410, 40, 620, 210),
+        "min_area": 20,
+    },
+    "wristband": {
+        "source": "wristband.png",
+        "threshold": 55,
+        "focus": (340, 450, 430, 570),
+        "min_area": 20,
+    },
+    "watch": {
+        "source": "watch.png",
+        "threshold": 55,
+        "focus": (610, 425, 685, 575),
+        "min_area": 20,
+    },
+    "nikeshirt": {
+        "source": "nikeshirt.png",
+        "threshold": 55,
+        "focus": (360, 210, 665, 420),
+        "min_area": 400,
+    },
+    "nikesinglet": {
+        "source": "nikesinglet.png",
+        "threshold": 55,
+        "focus": (360, 210, 640, 420),
+        "min_area": 200,
+    },
+}
+
+
+def intersects(first, second):
+    ax1, ay1, ax2, ay2 = first
+    bx1, by1, bx2, by2 = second
+    return ax1 < bx2 and ax2 > bx1 and ay1 < by2 and ay2 > by1
+
+
+def changed_pixel_mask(base, image, threshold):
+    diff = ImageChops.difference(base, image)
+    width, height = diff.size
+    diff_pixels = diff.load()
+    mask = bytearray(width * height)
+
+    for y in range(height):
+        row = y * width
+        for x in range(width):
+            if max(diff_pixels[x, y]) > threshold:
+                mask[row + x] = 1
+
+    return mask, width, height
+
+
+def selected_component_mask(base, image, config):
+    if np is not None:
+        selected = selected_component_mask_numpy(base, image, config)
+    else:
+        selected = selected_component_mask_python(base, image, config)
+    return selected.filter(ImageFilter.MaxFilter(9)).filter(ImageFilter.GaussianBlur(1.2))
+
+
+def selected_component_mask_python(base, image, config):
+    mask, width, height = changed_pixel_mask(base, image, config["threshold"])
+    seen = bytearray(width * height)
+    selected = Image.new("L", (width, height), 0)
+    selected_pixels = selected.load()
+
+    for idx, value in enumerate(mask):
+        if not value or seen[idx]:
+            continue
+
+        stack = [idx]
+        seen[idx] = 1
+        pixels = []
+        min_x = width
+        min_y = height
+        max_x = 0
+        max_y = 0
+
+        while stack:
+            current = stack.pop()
+            pixels.append(current)
+            x = current % width
+            y = current // width
+            min_x = min(min_x, x)
+            min_y = min(min_y, y)
+            max_x = max(max_x, x)
+            max_y = max(max_y, y)
+
+            for next_y in (y - 1, y, y + 1):
+                if next_y < 0 or next_y >= height:
+                    continue
+                for next_x in (x - 1, x, x + 1):
+                    if next_x < 0 or next_x >= width or (next_x == x and next_y == y):
+                        continue
+                    next_idx = next_y * width + next_x
+                    if mask[next_idx] and not seen[next_idx]:
+                        seen[next_idx] = 1
+                        stack.append(next_idx)
+
+        bbox = (min_x, min_y, max_x + 1, max_y + 1)
+        if len(pixels) < config["min_area"] or not intersects(bbox, config["focus"]):
+            continue
+
+        for pixel_idx in pixels:
+            selected_pixels[pixel_idx % width, pixel_idx // width] = 255
+
+    return selected
+
+
+def changed_pixel_array(base, image, threshold):
+    diff = np.asarray(ImageChops.difference(base, image))
+    if diff.ndim == 3:
+        diff = diff.max(axis=2)
+    return diff > threshold
+
+
+def pixel_runs(mask):
+    # Horizontal runs of set pixels as (row, start, end) with `end` exclusive,
+    # in row-major order.
+    height, width = mask.shape
+    padded = np.zeros((height, width + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    edges = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    _, ends = np.nonzero(edges == -1)
+    return rows, starts, ends
+
+
+def label_runs(rows, starts, ends, height):
+    # Union-find over runs: two runs on adjacent rows belong to the same
+    # 8-connected component when their column ranges touch, diagonals included.
+    parent = list(range(len(rows)))
+
+    def find(run):
+        while parent[run] != run:
+            parent[run] = parent[parent[run]]
+            run = parent[run]
+        return run
+
+    row_bounds = np.searchsorted(rows, np.arange(height + 1))
+    for y in range(1, height):
+        first, last = row_bounds[y], row_bounds[y + 1]
+        prev_first, prev_last = row_bounds[y - 1], row_bounds[y]
+        if first == last or prev_first == prev_last:
+            continue
+
+        prev_starts = starts[prev_first:prev_last]
+        prev_ends = ends[prev_first:prev_last]
+        lows = prev_first + np.searchsorted(prev_ends, starts[first:last], side="left")
+        highs = prev_first + np.searchsorted(prev_starts, ends[first:last], side="right")
+
+        for run, low, high in zip(range(first, last), lows.tolist(), highs.tolist()):
+            root = find(run)
+            for other in range(low, high):
+                other_root = find(other)
+                if other_root != root:
+                    parent[other_root] = root
+
+    roots = np.array([find(run) for run in range(len(rows))], dtype=np.int64)
+    _, labels = np.unique(roots, return_inverse=True)
+    return labels
+
+
+def selected_component_mask_numpy(base, image, config):
+    mask = changed_pixel_array(base, image, config["threshold"])
+    height, width = mask.shape
+    rows, starts, ends = pixel_runs(mask)
+    selected = np.zeros((height, width), dtype=np.uint8)
+    if len(rows) == 0:
+        return Image.fromarray(selected, "L")
+
+    labels = label_runs(rows, starts, ends, height)
+    count = labels.max() + 1
+
+    areas = np.bincount(labels, weights=ends - starts, minlength=count)
+    min_x = np.full(count, width)
+    min_y = np.full(count, height)
+    max_x = np.zeros(count, dtype=np.int64)
+    max_y = np.zeros(count, dtype=np.int64)
+    np.minimum.at(min_x, labels, starts)
+    np.minimum.at(min_y, labels, rows)
+    np.maximum.at(max_x, labels, ends)
+    np.maximum.at(max_y, labels, rows + 1)
+
+    fx1, fy1, fx2, fy2 = config["focus"]
+    keep = (
+        (areas >= config["min_area"])
+        & (min_x < fx2) & (max_x > fx1)
+        & (min_y < fy2) & (max_y > fy1)
+    )
+
+    kept = keep[labels]
+    coverage = np.zeros((height, width + 1), dtype=np.int32)
+    np.add.at(coverage, (rows[kept], starts[kept]), 1)
+    np.add.at(coverage, (rows[kept], ends[kept]), -1)
+    selected[np.cumsum(coverage, axis=1)[:, :width] > 0] = 255
+    return Image.fromarray(selected, "L")
+
+
+def file_hash(path):
+    return hashlib.sha256(Path(path).read_bytes()).hexdigest()
+
+
+def item_hashes(avatar_dir):
+    hashes = {}
+    for key, config in ITEMS.items():
+        digest = hashlib.sha256()
+        digest.update(file_hash(avatar_dir / config["source"]).encode())
+        digest.update(json.dumps(config, sort_keys=True).encode())
+        hashes[key] = digest.hexdigest()
+    return hashes
+
+
+def combo_hash(keys, base_hash, hashes):
+    # Only the layers in this combination contribute, so adding or changing
+    # one item leaves every combination without it untouched.
+    digest = hashlib.sha256(f"{RENDER_VERSION}:{base_hash}".encode())
+    for key in LAYER_ORDER:
+        if key in keys:
+            digest.update(f"|{key}:{hashes[key]}".encode())
+    return digest.hexdigest()
+
+
+def cropped_layer(source, mask):
+    # Cut the item down to its mask's bounding box once, so compositing only
+    # touches the pixels the item actually covers.
+    bbox = mask.getbbox()
+    if bbox is None:
+        return None
+    layer = source.crop(bbox).convert("RGBA")
+    layer.putalpha(mask.crop(bbox))
+    return bbox[:2], layer
+
+
+def composite_combination(base_rgba, layers, keys):
+    composite = base_rgba.copy()
+
+    for key in LAYER_ORDER:
+        if key not in keys or layers[key] is None:
+            continue
+        offset, layer = layers[key]
+        composite.alpha_composite(layer, dest=offset)
+
+    return composite.convert("RGB")
+
+
+def encode_sprite(image):
+    # Base and item sprites for client-side stacking; WebP keeps the alpha channel.
+    buffer = BytesIO()
+    image.save(buffer, format="WEBP", quality=WEBP_QUALITY, method=6)
+    return buffer.getvalue()
+
+
+def load_layer_manifest(layers_dir=LAYERS_DIR):
+    """Return the sprite manifest written by the generator, or None if absent."""
+    try:
+        manifest = json.loads((Path(layers_dir) / LAYER_MANIFEST_NAME).read_text())
+    except (OSError, ValueError):
+        return None
+    if manifest.get("render_version") != RENDER_VERSION or not manifest.get("layers"):
+        return None
+    return manifest
+
+
+def encode_avatar(image, width=None):
+    # Full size is PNG; smaller variants are resized and encoded as WebP.
+    buffer = BytesIO()
+    if width is None:
+        image.save(buffer, format="PNG")
+    else:
+        height = round(image.height * width / image.width)
+        image.resize((width, height), Image.LANCZOS).save(buffer, format="WEBP", quality=WEBP_QUALITY)
+    return buffer.getvalue()
+
+
+class AvatarRenderer:
+    """Composites item combinations on request instead of reading pre-rendered files.
+
+    The base image and item layers are prepared once, on first use. When a
+    full-size PNG already exists in `prerendered_dir` it is used as the source
+    for resized variants instead of compositing. Encoded images are kept in a
+    byte-bounded LRU and can optionally be written to `disk_cache_dir`, keyed
+    by content hash and size.
+    """
+
+    def __init__(self, avatar_dir=AVATAR_DIR, prerendered_dir=None, memory_cache=None, disk_cache_dir=None):
+        self.avatar_dir = Path(avatar_dir)
+        self.prerendered_dir = Path(prerendered_dir) if prerendered_dir else None
+        self.memory_cache = memory_cache
+        self.disk_cache_dir = Path(disk_cache_dir) if disk_cache_dir else None
+        self._base = None
+        self._base_rgba = None
+        self._base_hash = None
+        self._hashes = None
+        self._layers = {}
+        self._file_hashes = {}
+        self._lock = threading.Lock()
+
+    def _prepare(self):
+        with self._lock:
+            if self._base is None:
+                base_path = self.avatar_dir / "default.jpg"
+                self._base_hash = file_hash(base_path)
+                self._hashes = item_hashes(self.avatar_dir)
+                self._base = Image.open(base_path).convert("RGB")
+                self._base_rgba = self._base.convert("RGBA")
+
+    def _layer(self, key):
+        with self._lock:
+            layer = self._layers.get(key)
+        if layer is not None:
+            return layer
+        # Extracted outside the lock so a cold cache does not serialize every
+        # render behind one mask computation; if two threads race, both
+        # results are identical and the first one stored wins.
+        config = ITEMS[key]
+        source = Image.open(self.avatar_dir / config["source"]).convert("RGB")
+        layer = cropped_layer(source, selected_component_mask(self._base, source, config))
+        with self._lock:
+            return self._layers.setdefault(key, layer)
+
+    def _prerendered(self, keys):
+        if not self.prerendered_dir:
+            return None
+        path = self.prerendered_dir / ("__".join(keys) + ".png")
+        try:
+            stamp = path.stat().st_mtime_ns
+        except OSError:
+            return None
+        with self._lock:
+            cached = self._file_hashes.get(path)
+            if cached and cached[0] == stamp:
+                return path, cached[1]
+        digest = file_hash(path)
+        with self._lock:
+            self._file_hashes[path] = (stamp, digest)
+        return path, digest
+
+    def etag(self, keys, width=None):
+        prerendered = self._prerendered(keys)
+        if prerendered:
+            digest = prerendered[1]
+        else:
+            self._prepare()
+            digest = combo_hash(keys, self._base_hash, self._hashes)
+        return f"{digest}-{width or 'full'}"
+
+    def render(self, keys, width=None):
+        """Return (image_bytes, etag): PNG at full size, WebP when `width` is given."""
+        etag = self.etag(keys, width)
+
+        if self.memory_cache is not None:
+            cached = self.memory_cache.get(etag)
+            if cached is not None:
+                return cached, etag
+
+        suffix = ".webp" if width else ".png"
+        disk_path = self.disk_cache_dir / f"{etag}{suffix}" if self.disk_cache_dir else None
+        if disk_path and disk_path.exists():
+            data = disk_path.read_bytes()
+        else:
+            prerendered = self._prerendered(keys)
+            if prerendered:
+                image = Image.open(prerendered[0]).convert("RGB")
+            else:
+                layers = {key: self._layer(key) for key in keys}
+                image = composite_combination(self._base_rgba, layers, keys)
+            data = encode_avatar(image, width)
+            if disk_path:
+                self.disk_cache_dir.mkdir(parents=True, exist_ok=True)
+                temp_path = disk_path.with_suffix(f".{threading.get_ident()}.tmp")
+                temp_path.write_bytes(data)
+                temp_path.replace(disk_path)
+
+        if self.memory_cache is not None:
+            self.memory_cache.set(etag, data)
+        return data, etag
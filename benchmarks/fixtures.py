@@ -0,0 +1,97 @@
+"""Synthetic data for benchmarks: a throwaway SQLite database with users,
+profiles, inventories and workout history, built through the app's migrations.
+"""
+
+import random
+import sqlite3
+import sys
+from datetime import date, timedelta
+from pathlib import Path
+
+from werkzeug.security import generate_password_hash
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+import database  # noqa: E402
+import ippt  # noqa: E402
+import items  # noqa: E402
+import rollups  # noqa: E402
+
+PASSWORD = "benchmark"
+USERNAME_FORMAT = "bench{:06d}"
+
+
+def random_inventory(rng, owned_count):
+    owned = rng.sample(items.SHOP_ITEM_ORDER, min(owned_count, len(items.SHOP_ITEM_ORDER)))
+    equipped = [key for key in owned if rng.random() < 0.6]
+    # normalize_item_keys keeps at most one top, like the shop does.
+    equipped = items.normalize_item_keys(equipped)
+    return items.mask_from_keys(owned) | items.mask_from_keys(equipped), items.mask_from_keys(equipped), equipped
+
+
+def seed_database(path, users=100, workouts_per_user=30, owned_items_per_user=3, seed=0, password=PASSWORD):
+    """Create a fresh database at `path` and return the seeded user ids.
+
+    Every user shares one password hash, so seeding 100k users costs one
+    hashing round rather than 100k.
+    """
+    path = Path(path)
+    for suffix in ("", "-wal", "-shm"):
+        Path(f"{path}{suffix}").unlink(missing_ok=True)
+
+    rng = random.Random(seed)
+    password_hash = generate_password_hash(password)
+    today = date.today()
+
+    connection = sqlite3.connect(path)
+    try:
+        database.migrate(connection)
+        connection.executemany(
+            "INSERT INTO users (id, username, password) VALUES (?, ?, ?)",
+            ((user_id, USERNAME_FORMAT.format(user_id), password_hash) for user_id in range(1, users + 1)),
+        )
+
+        profiles = []
+        workouts = []
+        for user_id in range(1, users + 1):
+            age = rng.randint(18, 60)
+            dob = date(today.year - age, rng.randint(1, 12), rng.randint(1, 28))
+            owned_mask, equipped_mask, equipped = random_inventory(rng, rng.randint(0, owned_items_per_user))
+            xp = 0
+            for day in range(workouts_per_user, 0, -1):
+                pushups = rng.randint(10, 60)
+                situps = rng.randint(10, 60)
+                run = rng.randint(540, 1000)
+                score = ippt.score(age, situps, pushups, run)
+                xp += score
+                workouts.append((user_id, pushups, situps, run, score, (today - timedelta(days=day)).isoformat(), score))
+            profiles.append((
+                user_id, xp, rng.randint(1_000, 10_000), dob.isoformat(), "gold",
+                items.avatar_path_for_items(equipped), (today + timedelta(days=90)).isoformat(),
+                rng.randint(40, 90), owned_mask, equipped_mask,
+            ))
+
+        connection.executemany(
+            """
+            INSERT INTO profiles (
+                user_id, xp, credits, dob, goal, avatar_path, next_ippt_date,
+                prev_ippt_score, owned_mask, equipped_mask
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            profiles,
+        )
+        connection.executemany(
+            """
+            INSERT INTO workout_tracking (user_id, pushup, situp, run, score, date_submitted, xp)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            workouts,
+        )
+        rollups.rebuild(connection)
+        connection.commit()
+        connection.execute("ANALYZE")
+    finally:
+        connection.close()
+
+    return list(range(1, users + 1))
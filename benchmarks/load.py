@@ -0,0 +1,362 @@
+"""Load generator that simulates a unit's workout-day surge.
+
+    python benchmarks/load.py --users 50 --duration 30 --output load.json
+    python benchmarks/load.py --mix login=1 workout=5 home=3 leaderboard=6 purchase=1
+
+By default it seeds a scratch database and serves the app from a threaded
+WSGI server in this process, with IPPT scoring going to a local stub
+server. Many virtual users log in and then replay a weighted mix of
+requests. After the load stops it waits for the scoring queue to drain and
+reports what happened to the queued submissions. With --url it drives an
+already running server instead (SQLite lock errors are then only visible as
+500s, and the queue is not inspected).
+"""
+
+import argparse
+import contextlib
+import json
+import logging
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import requests
+
+from fixtures import PASSWORD, USERNAME_FORMAT, seed_database
+from routes import git_revision, percentile
+
+DEFAULT_MIX = {"login": 1, "workout": 3, "home": 4, "leaderboard": 4, "purchase": 1}
+HISTOGRAM_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+
+class Recorder:
+    """Thread-safe per-operation latencies, statuses and error counts."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.statuses = {}
+        self.errors = {}
+        self.exceptions = {}
+        self.locked = 0
+
+    def record(self, operation, elapsed, status=None, ok=True, exception=None):
+        with self._lock:
+            self.latencies.setdefault(operation, []).append(elapsed)
+            statuses = self.statuses.setdefault(operation, {})
+            key = str(status) if status is not None else "exception"
+            statuses[key] = statuses.get(key, 0) + 1
+            if not ok:
+                self.errors[operation] = self.errors.get(operation, 0) + 1
+            if exception is not None:
+                name = type(exception).__name__
+                self.exceptions[name] = self.exceptions.get(name, 0) + 1
+
+    def database_locked(self, sender, exception, **extra):
+        # Flask's got_request_exception signal; fires for unhandled errors in
+        # views. Lock errors hit by the scoring worker are retried instead and
+        # show up in drain_queue's report.
+        if isinstance(exception, sqlite3.OperationalError) and "locked" in str(exception):
+            with self._lock:
+                self.locked += 1
+
+
+def drain_queue(worker, db_path, timeout, poll=0.1):
+    """Wait for pending submissions to be scored, then summarise the queue.
+
+    The drain time is measured from the end of the load; if the queue is
+    still not empty after `timeout` seconds, `drained` is False.
+    """
+    db = sqlite3.connect(db_path, timeout=30)
+    try:
+        started = time.monotonic()
+        while True:
+            pending = db.execute("SELECT COUNT(*) FROM workout_submissions WHERE status = 'pending'").fetchone()[0]
+            if not pending or time.monotonic() - started >= timeout:
+                break
+            # Skips the dispatcher's poll interval between batches.
+            worker.notify()
+            time.sleep(poll)
+        drain_s = time.monotonic() - started
+        return {
+            "drain_s": round(drain_s, 2),
+            "drained": not pending,
+            "status": dict(db.execute(
+                "SELECT status, COUNT(*) FROM workout_submissions GROUP BY status ORDER BY status"
+            ).fetchall()),
+            "retried": db.execute("SELECT COUNT(*) FROM workout_submissions WHERE attempts > 1").fetchone()[0],
+            # Completing a submission clears its error, so this only counts
+            # the ones a lock error left pending or failed.
+            "locked": db.execute(
+                "SELECT COUNT(*) FROM workout_submissions WHERE error LIKE '%locked%'"
+            ).fetchone()[0],
+        }
+    finally:
+        db.close()
+
+
+def histogram(latencies):
+    counts = [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)
+    for elapsed in latencies:
+        milliseconds = elapsed * 1000
+        for index, bound in enumerate(HISTOGRAM_BUCKETS_MS):
+            if milliseconds <= bound:
+                counts[index] += 1
+                break
+        else:
+            counts[-1] += 1
+    labels = [f"<={bound}ms" for bound in HISTOGRAM_BUCKETS_MS] + [f">{HISTOGRAM_BUCKETS_MS[-1]}ms"]
+    return dict(zip(labels, counts))
+
+
+def operation_stats(latencies, statuses, errors, elapsed):
+    ordered = sorted(latencies)
+    return {
+        "requests": len(ordered),
+        "errors": errors,
+        "error_rate": round(errors / len(ordered), 4) if ordered else 0.0,
+        "throughput_rps": round(len(ordered) / elapsed, 2),
+        "status": statuses,
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(ordered, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2),
+        "histogram": histogram(ordered),
+    }
+
+
+class VirtualUser:
+    def __init__(self, base_url, user_id, recorder, rng, shop_items, timeout):
+        self.base_url = base_url
+        self.username = USERNAME_FORMAT.format(user_id)
+        self.recorder = recorder
+        self.rng = rng
+        self.shop_items = shop_items
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def _request(self, operation, method, path, expected=(200,), **kwargs):
+        begin = time.perf_counter()
+        try:
+            response = self.session.request(
+                method, self.base_url + path, timeout=self.timeout, allow_redirects=False, **kwargs
+            )
+        except requests.RequestException as exc:
+            self.recorder.record(operation, time.perf_counter() - begin, ok=False, exception=exc)
+            return None
+        self.recorder.record(
+            operation, time.perf_counter() - begin, response.status_code, response.status_code in expected
+        )
+        return response
+
+    def login(self):
+        # A successful login redirects to /home; a bad password answers 200.
+        self._request("login", "POST", "/login", expected=(302,),
+                      data={"username": self.username, "password": PASSWORD})
+
+    def workout(self):
+        self._request("workout", "POST", "/workout", expected=(302,), data={
+            "pushups": self.rng.randint(10, 60),
+            "situps": self.rng.randint(10, 60),
+            "run_min": self.rng.randint(9, 16),
+            "run_sec": self.rng.randint(0, 59),
+        })
+
+    def home(self):
+        self._request("home", "GET", "/home")
+
+    def leaderboard(self):
+        self._request("leaderboard", "GET", "/leaderboard")
+
+    def purchase(self):
+        item = self.rng.choice(self.shop_items)
+        # Running out of credits is a normal answer (400), not a server error.
+        self._request("purchase", "POST", "/purchase_items", expected=(200, 400),
+                      json={"avatar_path": item["key"], "price": item["price"]})
+
+    def run(self, mix, deadline, think_time):
+        self.login()
+        operations, weights = zip(*mix.items())
+        while time.monotonic() < deadline:
+            getattr(self, self.rng.choices(operations, weights)[0])()
+            if think_time:
+                time.sleep(self.rng.uniform(0, 2 * think_time))
+        self.session.close()
+
+
+def parse_mix(values):
+    mix = {}
+    for value in values:
+        name, _, weight = value.partition("=")
+        if name not in DEFAULT_MIX or not weight:
+            raise SystemExit(f"Bad --mix entry {value!r}; use NAME=WEIGHT with NAME in {', '.join(DEFAULT_MIX)}")
+        mix[name] = float(weight)
+    return {name: weight for name, weight in mix.items() if weight > 0}
+
+
+@contextlib.contextmanager
+def local_server(args, workdir, recorder):
+    from werkzeug.serving import make_server
+
+    db_path = Path(workdir) / "load.db"
+    seed_database(db_path, args.accounts, args.workouts, seed=args.seed)
+    os.environ["DATABASE_PATH"] = str(db_path)
+
+    with contextlib.ExitStack() as stack:
+        import app as appmod
+        from flask import got_request_exception
+        from ippt_client import IPPTClient
+        from ippt_stub import StubIPPTServer
+
+        stub = stack.enter_context(StubIPPTServer(latency=args.ippt_latency))
+        appmod.ippt_client = IPPTClient(stub.url)
+        appmod.app.config["IPPT_REMOTE_SCORING"] = not args.no_ippt
+        got_request_exception.connect(recorder.database_locked, appmod.app)
+
+        # One access-log line per request would swamp the report.
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)
+        server = make_server("127.0.0.1", 0, appmod.app, threaded=True)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        stack.callback(appmod.scoring_worker.stop)
+        stack.callback(appmod.password_hasher.shutdown)
+        stack.callback(thread.join)
+        stack.callback(server.shutdown)
+
+        def drain():
+            return drain_queue(appmod.scoring_worker, db_path, args.drain_timeout)
+
+        yield f"http://127.0.0.1:{server.server_port}", appmod.SHOP_ITEMS, stub, drain
+
+
+def run_load(base_url, shop_items, args, recorder):
+    rng = random.Random(args.seed)
+    user_ids = rng.sample(range(1, args.accounts + 1), min(args.users, args.accounts))
+    mix = parse_mix(args.mix) if args.mix else DEFAULT_MIX
+
+    started = time.monotonic()
+    deadline = started + args.duration
+    threads = []
+    for index, user_id in enumerate(user_ids):
+        user = VirtualUser(base_url, user_id, recorder, random.Random(rng.random()), shop_items, args.timeout)
+        thread = threading.Thread(target=user.run, args=(mix, deadline, args.think_time), daemon=True)
+        threads.append(thread)
+        thread.start()
+        if args.ramp_up:
+            time.sleep(args.ramp_up / len(user_ids))
+    for thread in threads:
+        thread.join()
+    return time.monotonic() - started, mix
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate many users hitting the app at once.")
+    parser.add_argument("--users", type=int, default=50, help="concurrent virtual users")
+    parser.add_argument("--accounts", type=int, default=500, help="users seeded into the scratch database")
+    parser.add_argument("--workouts", type=int, default=30, help="seeded workout entries per account")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds to generate load")
+    parser.add_argument("--ramp-up", type=float, default=0.0, help="seconds over which users start")
+    parser.add_argument("--think-time", type=float, default=0.0, help="mean pause between a user's requests")
+    parser.add_argument("--mix", nargs="+", metavar="NAME=WEIGHT",
+                        help=f"request mix (default: {' '.join(f'{k}={v}' for k, v in DEFAULT_MIX.items())})")
+    parser.add_argument("--timeout", type=float, default=30.0, help="client timeout per request")
+    parser.add_argument("--ippt-latency", type=float, default=0.0, help="stub IPPT latency in seconds")
+    parser.add_argument("--no-ippt", action="store_true", help="score with the local tables instead of the stub API")
+    parser.add_argument("--drain-timeout", type=float, default=60.0,
+                        help="seconds to wait for the scoring queue to empty after the load")
+    parser.add_argument("--url", help="drive an already running server (its accounts must match the fixture)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="write results as JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    recorder = Recorder()
+    stub_requests = None
+    queue = None
+
+    with tempfile.TemporaryDirectory(prefix="load-bench-") as workdir:
+        if args.url:
+            sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+            from items import SHOP_ITEMS
+            elapsed, mix = run_load(args.url.rstrip("/"), SHOP_ITEMS, args, recorder)
+        else:
+            with local_server(args, workdir, recorder) as (base_url, shop_items, stub, drain):
+                elapsed, mix = run_load(base_url, shop_items, args, recorder)
+                queue = drain()
+                stub_requests = stub.requests
+
+    operations = {
+        name: operation_stats(latencies, recorder.statuses[name], recorder.errors.get(name, 0), elapsed)
+        for name, latencies in sorted(recorder.latencies.items())
+    }
+    total = sum(stats["requests"] for stats in operations.values())
+    errors = sum(stats["errors"] for stats in operations.values())
+    all_latencies = [value for latencies in recorder.latencies.values() for value in latencies]
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "target": args.url or "in-process",
+            "users": args.users,
+            "accounts": args.accounts,
+            "duration": args.duration,
+            "think_time": args.think_time,
+            "mix": mix,
+            "ippt_remote_scoring": not args.no_ippt and not args.url,
+        },
+        "summary": {
+            "elapsed_s": round(elapsed, 2),
+            "requests": total,
+            "throughput_rps": round(total / elapsed, 2),
+            "errors": errors,
+            "error_rate": round(errors / total, 4) if total else 0.0,
+            "database_locked": recorder.locked if not args.url else None,
+            "exceptions": recorder.exceptions,
+            "stub_ippt_requests": stub_requests,
+            "histogram": histogram(all_latencies),
+        },
+        "scoring_queue": queue,
+        "operations": operations,
+    }
+
+    summary = report["summary"]
+    print(
+        f"{total} requests in {summary['elapsed_s']} s ({summary['throughput_rps']} req/s), "
+        f"{errors} errors, {summary['database_locked']} 'database is locked'",
+        file=sys.stderr,
+    )
+    if queue is not None:
+        print(
+            f"  scoring queue {'drained' if queue['drained'] else 'NOT drained'} in {queue['drain_s']} s: "
+            f"{', '.join(f'{count} {status}' for status, count in queue['status'].items()) or 'empty'}, "
+            f"{queue['retried']} retried, {queue['locked']} still failing with 'database is locked'",
+            file=sys.stderr,
+        )
+    for name, stats in operations.items():
+        print(
+            f"  {name:<12} {stats['requests']:>7} req  {stats['throughput_rps']:>8.1f} req/s  "
+            f"p50 {stats['p50_ms']:>8.1f} ms  p95 {stats['p95_ms']:>8.1f} ms  p99 {stats['p99_ms']:>8.1f} ms  "
+            f"{stats['errors']} errors",
+            file=sys.stderr,
+        )
+
+    text = json.dumps(report, indent=2) + "\n"
+    if args.output:
+        args.output.write_text(text)
+    else:
+        sys.stdout.write(text)
+
+
+if __name__ == "__main__":
+    main()
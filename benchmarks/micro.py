@@ -0,0 +1,232 @@
+"""Micro-benchmarks for the pure helpers and the avatar pipeline.
+
+    python benchmarks/micro.py --output micro.json
+    python benchmarks/micro.py --baseline micro.json --max-ratio 1.25
+
+Each benchmark is timed with timeit (best and median of several repeats,
+reported per call) and run once more under tracemalloc for its peak
+allocation. With --baseline, the run fails if any benchmark's best time grew
+past --max-ratio times the baseline's.
+"""
+
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import timeit
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+
+from fixtures import ROOT
+
+import avatar  # noqa: E402  (fixtures puts the project root on sys.path)
+import items  # noqa: E402
+
+ITEM_VALUES = [
+    ["headband", "watch"],
+    ["/static/avatar/combinations/nikeshirt__headband__watch.png"],
+    ["Headphones", "wristband", "nikesinglet", "nikeshirt"],
+    [],
+]
+RAW_VALUES = [
+    "/static/avatar/combinations/nikesinglet__headband__headphones__watch.png",
+    "headband,watch",
+    "/static/avatar/default.jpg",
+    "unknown-item",
+]
+
+
+def load_generator():
+    path = ROOT / "scripts" / "generate_avatar_combinations.py"
+    spec = importlib.util.spec_from_file_location("generate_avatar_combinations", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def import_app(workdir):
+    # Importing the app migrates its database; keep that in the scratch directory.
+    os.environ["DATABASE_PATH"] = str(Path(workdir) / "micro.db")
+    import app as appmod
+    return appmod
+
+
+def helper_benchmarks(appmod):
+    def uncached_item_keys():
+        items._parse_item_keys.cache_clear()
+        for value in RAW_VALUES:
+            items.item_keys_from_value(value)
+
+    return {
+        "normalize_item_keys": lambda: [items.normalize_item_keys(values) for values in ITEM_VALUES],
+        "item_keys_from_value": lambda: [items.item_keys_from_value(value) for value in RAW_VALUES],
+        "item_keys_from_value_uncached": uncached_item_keys,
+        "avatar_path_for_items": lambda: [items.avatar_path_for_items(values) for values in ITEM_VALUES],
+        "format_time": lambda: [appmod.format_time(seconds) for seconds in (0, 59, 600, 754, 3599)],
+    }
+
+
+def avatar_benchmarks(avatar_dir, workdir, generator_runs, only=None):
+    from PIL import Image
+
+    base = Image.open(avatar_dir / "default.jpg").convert("RGB")
+    key = "nikeshirt"
+    config = avatar.ITEMS[key]
+    source = Image.open(avatar_dir / config["source"]).convert("RGB")
+    generator = load_generator()
+
+    def generator_argv(output):
+        return [
+            "--avatar-dir", str(avatar_dir),
+            "--output-dir", str(Path(output) / "combinations"),
+            "--layers-dir", str(Path(output) / "layers"),
+            "--jobs", "1",
+        ]
+
+    def full_build():
+        with tempfile.TemporaryDirectory(dir=workdir) as output:
+            with contextlib.redirect_stdout(io.StringIO()):
+                generator.main(generator_argv(output))
+
+    # The no-op rebuild needs a finished build to compare against; skip that
+    # (slow) setup when the benchmark is not selected.
+    incremental_output = Path(workdir) / "incremental"
+    if not only or "generator_main_incremental" in only:
+        with contextlib.redirect_stdout(io.StringIO()):
+            generator.main(generator_argv(incremental_output))
+
+    def incremental_build():
+        with contextlib.redirect_stdout(io.StringIO()):
+            generator.main(generator_argv(incremental_output))
+
+    benchmarks = {
+        "changed_pixel_mask": (lambda: avatar.changed_pixel_mask(base, source, config["threshold"]), None),
+        "selected_component_mask": (lambda: avatar.selected_component_mask(base, source, config), None),
+        "selected_component_mask_python": (
+            lambda: avatar.selected_component_mask_python(base, source, config), None
+        ),
+        "generator_main_incremental": (incremental_build, None),
+        "generator_main_full": (full_build, generator_runs),
+    }
+    if avatar.np is not None:
+        benchmarks["selected_component_mask_numpy"] = (
+            lambda: avatar.selected_component_mask_numpy(base, source, config), None
+        )
+    return benchmarks
+
+
+def measure(function, repeat, number=None):
+    timer = timeit.Timer(function)
+    if number is None:
+        # Enough calls per repeat to take at least 0.2 s.
+        number, _ = timer.autorange()
+    times = [total / number for total in timer.repeat(repeat=repeat, number=number)]
+
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "number": number,
+        "repeat": repeat,
+        "best_us": round(min(times) * 1e6, 3),
+        "median_us": round(statistics.median(times) * 1e6, 3),
+        "peak_kib": round(peak / 1024, 1),
+    }
+
+
+def check_regressions(results, baseline_path, max_ratio):
+    baseline = json.loads(Path(baseline_path).read_text())["benchmarks"]
+    regressions = []
+    for name, stats in results.items():
+        old = baseline.get(name)
+        if not old or not old["best_us"]:
+            continue
+        ratio = stats["best_us"] / old["best_us"]
+        stats["ratio"] = round(ratio, 3)
+        marker = "REGRESSION" if ratio > max_ratio else "ok"
+        print(f"  {name:<32} {old['best_us']:>14.2f} -> {stats['best_us']:>14.2f} us  {ratio:5.2f}x  {marker}",
+              file=sys.stderr)
+        if ratio > max_ratio:
+            regressions.append(name)
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for helpers and the avatar pipeline.")
+    parser.add_argument("--avatar-dir", type=Path, default=avatar.AVATAR_DIR,
+                        help="directory with default.jpg and item sources")
+    parser.add_argument("--repeat", type=int, default=5, help="timing repeats per benchmark")
+    parser.add_argument("--generator-runs", type=int, default=1,
+                        help="full generator builds per repeat (they take seconds each)")
+    parser.add_argument("--skip-avatar", action="store_true", help="only run the helper benchmarks")
+    parser.add_argument("--only", nargs="+", help="run only these benchmarks")
+    parser.add_argument("--output", type=Path, help="write results as JSON")
+    parser.add_argument("--baseline", type=Path, help="compare against an earlier --output file")
+    parser.add_argument("--max-ratio", type=float, default=1.25,
+                        help="with --baseline, fail when best time exceeds baseline by this factor")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="micro-bench-") as workdir:
+        appmod = import_app(workdir)
+        benchmarks = {name: (function, None) for name, function in helper_benchmarks(appmod).items()}
+
+        if args.skip_avatar:
+            pass
+        elif not (args.avatar_dir / "default.jpg").exists():
+            print(f"Skipping avatar benchmarks: no default.jpg in {args.avatar_dir}", file=sys.stderr)
+        else:
+            benchmarks.update(avatar_benchmarks(args.avatar_dir, workdir, args.generator_runs, args.only))
+
+        if args.only:
+            benchmarks = {name: benchmarks[name] for name in args.only if name in benchmarks}
+
+        results = {}
+        for name, (function, number) in benchmarks.items():
+            repeat = args.repeat if number is None else 1
+            results[name] = measure(function, repeat, number)
+            print(
+                f"  {name:<32} best {results[name]['best_us']:>14.2f} us  "
+                f"median {results[name]['median_us']:>14.2f} us  peak {results[name]['peak_kib']:>10.1f} KiB",
+                file=sys.stderr,
+            )
+
+    regressions = check_regressions(results, args.baseline, args.max_ratio) if args.baseline else []
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": avatar.np is not None,
+            "repeat": args.repeat,
+        },
+        "benchmarks": results,
+    }
+    text = json.dumps(report, indent=2) + "\n"
+    if args.output:
+        args.output.write_text(text)
+    elif not args.baseline:
+        sys.stdout.write(text)
+
+    if regressions:
+        raise SystemExit(f"{len(regressions)} benchmark(s) slower than {args.max_ratio}x baseline: "
+                         + ", ".join(regressions))
+
+
+if __name__ == "__main__":
+    main()
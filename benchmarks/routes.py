@@ -0,0 +1,290 @@
+"""Route-level latency and query-count benchmarks on a synthetic database.
+
+    python benchmarks/routes.py --users 100 1000 10000 --output results.json
+    python benchmarks/routes.py --compare before.json after.json
+
+Each database size gets a fresh fixture; every route is exercised through the
+Flask test client by a rotating set of signed-in users.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from fixtures import ROOT, USERNAME_FORMAT, seed_database
+
+TRANSACTION_CONTROL = ("BEGIN", "COMMIT", "ROLLBACK", "SAVEPOINT", "RELEASE", "PRAGMA")
+
+
+class QueryCounter:
+    """sqlite3 trace callback that counts statements, ignoring transaction control."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, statement):
+        if not statement.lstrip().upper().startswith(TRANSACTION_CONTROL):
+            self.count += 1
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, queries, statuses):
+    ordered = sorted(latencies)
+    status_counts = {}
+    for status in statuses:
+        status_counts[str(status)] = status_counts.get(str(status), 0) + 1
+    return {
+        "requests": len(latencies),
+        "errors": sum(1 for status in statuses if status >= 400),
+        "status": status_counts,
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3),
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(ordered, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+        "queries_mean": round(sum(queries) / len(queries), 2),
+        "queries_max": max(queries),
+    }
+
+
+def _workout(client, rng, user_id):
+    return client.post("/workout", data={
+        "pushups": rng.randint(10, 60),
+        "situps": rng.randint(10, 60),
+        "run_min": rng.randint(9, 16),
+        "run_sec": rng.randint(0, 59),
+    })
+
+
+def _save_shop(client, rng, user_id, shop_items):
+    owned = [item["key"] for item in shop_items]
+    equipped = rng.sample(owned, rng.randint(0, 3))
+    return client.post("/shop/save", json={
+        # Keep credits high enough that the purchase benchmark measures successes.
+        "credits": rng.randint(5_000, 10_000),
+        "owned_items": owned,
+        "equipped_items": equipped,
+    })
+
+
+def _purchase(client, rng, user_id, shop_items):
+    item = rng.choice(shop_items)
+    return client.post("/purchase_items", json={"avatar_path": item["key"], "price": item["price"]})
+
+
+def build_routes(appmod):
+    shop_items = appmod.SHOP_ITEMS
+    return {
+        "home": lambda client, rng, user_id: client.get("/home"),
+        "shop": lambda client, rng, user_id: client.get("/shop"),
+        "leaderboard": lambda client, rng, user_id: client.get("/leaderboard"),
+        "leaderboard_week": lambda client, rng, user_id: client.get("/leaderboard?window=week"),
+        "tracker": lambda client, rng, user_id: client.get("/tracker"),
+        "workout_post": _workout,
+        "shop_save": lambda client, rng, user_id: _save_shop(client, rng, user_id, shop_items),
+        "purchase_items": lambda client, rng, user_id: _purchase(client, rng, user_id, shop_items),
+    }
+
+
+def signed_in_client(app, user_id):
+    # Sign in through the session directly so password hashing does not
+    # dominate setup; /login is exercised by the load harness instead.
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["_user_id"] = str(user_id)
+        session["_fresh"] = True
+        session["username"] = USERNAME_FORMAT.format(user_id)
+    return client
+
+
+def run_size(appmod, routes, selected, users, args, workdir):
+    db_path = Path(workdir) / f"bench-{users}.db"
+    started = time.perf_counter()
+    user_ids = seed_database(db_path, users, args.workouts, args.inventory, args.seed)
+    seed_seconds = time.perf_counter() - started
+
+    appmod.DATABASE = str(db_path)
+    appmod.scoring_worker.database_path = str(db_path)
+    appmod.user_cache.clear()
+    appmod.summary_cache.clear()
+
+    counter = QueryCounter()
+    original_get_db = appmod.get_db
+
+    def counted_get_db():
+        db = original_get_db()
+        db.set_trace_callback(counter)
+        return db
+
+    rng = random.Random(args.seed)
+    clients = [
+        (user_id, signed_in_client(appmod.app, user_id))
+        for user_id in rng.sample(user_ids, min(args.clients, len(user_ids)))
+    ]
+
+    results = {}
+    appmod.get_db = counted_get_db
+    try:
+        for name in selected:
+            request = routes[name]
+            latencies, queries, statuses = [], [], []
+            for iteration in range(args.warmup + args.requests):
+                user_id, client = clients[iteration % len(clients)]
+                if args.cold_cache:
+                    appmod.user_cache.clear()
+                    appmod.summary_cache.clear()
+                counter.count = 0
+                begin = time.perf_counter()
+                response = request(client, rng, user_id)
+                elapsed = time.perf_counter() - begin
+                if iteration >= args.warmup:
+                    latencies.append(elapsed)
+                    queries.append(counter.count)
+                    statuses.append(response.status_code)
+            results[name] = summarize(latencies, queries, statuses)
+            print(
+                f"  {name:<15} p50 {results[name]['p50_ms']:8.2f} ms  "
+                f"p95 {results[name]['p95_ms']:8.2f} ms  p99 {results[name]['p99_ms']:8.2f} ms  "
+                f"{results[name]['queries_mean']:5.1f} queries  {results[name]['errors']} errors",
+                file=sys.stderr,
+            )
+    finally:
+        appmod.get_db = original_get_db
+        appmod.scoring_worker.stop()
+        appmod.get_pool(str(db_path)).close_all()
+
+    return {
+        "users": users,
+        "workouts_per_user": args.workouts,
+        "seed_seconds": round(seed_seconds, 3),
+        "db_bytes": db_path.stat().st_size,
+        "routes": results,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(before_path, after_path):
+    before = json.loads(Path(before_path).read_text())
+    after = json.loads(Path(after_path).read_text())
+    before_runs = {run["users"]: run for run in before["runs"]}
+    for run in after["runs"]:
+        previous = before_runs.get(run["users"])
+        if not previous:
+            continue
+        print(f"users={run['users']}")
+        for name, stats in run["routes"].items():
+            old = previous["routes"].get(name)
+            if not old:
+                continue
+            ratios = "  ".join(
+                f"{metric} {old[metric]:.2f} -> {stats[metric]:.2f} ({stats[metric] / old[metric]:.2f}x)"
+                if old[metric] else f"{metric} {old[metric]:.2f} -> {stats[metric]:.2f}"
+                for metric in ("p50_ms", "p95_ms", "queries_mean")
+            )
+            print(f"  {name:<15} {ratios}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark app routes against a synthetic database.")
+    parser.add_argument("--users", type=int, nargs="+", default=[100, 1000], help="database sizes to run")
+    parser.add_argument("--workouts", type=int, default=30, help="workout entries per user")
+    parser.add_argument("--inventory", type=int, default=3, help="maximum owned items per user")
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per route")
+    parser.add_argument("--warmup", type=int, default=20, help="unmeasured requests per route")
+    parser.add_argument("--clients", type=int, default=20, help="signed-in users to rotate through")
+    parser.add_argument("--routes", nargs="+", help="subset of routes to run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cold-cache", action="store_true",
+                        help="clear the user and summary caches before every request")
+    parser.add_argument("--no-ippt", action="store_true", help="score with the local tables instead of the stub API")
+    parser.add_argument("--ippt-latency", type=float, default=0.0, help="stub IPPT latency in seconds")
+    parser.add_argument("--output", type=Path, help="write results as JSON")
+    parser.add_argument("--compare", nargs=2, type=Path, metavar=("BEFORE", "AFTER"),
+                        help="print the change between two result files and exit")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    with tempfile.TemporaryDirectory(prefix="routes-bench-") as workdir, contextlib.ExitStack() as stack:
+        # The app migrates its database on import; point it at the scratch directory.
+        os.environ["DATABASE_PATH"] = str(Path(workdir) / "import.db")
+        import app as appmod
+        from ippt_client import IPPTClient
+        from ippt_stub import StubIPPTServer
+
+        appmod.app.config["TESTING"] = True
+        # Score inside the request, so workout_post times the whole write path
+        # (scoring, upsert, rollups, summary) and not just the queue insert.
+        appmod.app.config["ASYNC_SCORING"] = False
+        # Never the real IPPT API: results must not depend on the network.
+        appmod.app.config["IPPT_REMOTE_SCORING"] = not args.no_ippt
+        if not args.no_ippt:
+            stub = stack.enter_context(StubIPPTServer(latency=args.ippt_latency))
+            appmod.ippt_client = IPPTClient(stub.url)
+        appmod.get_pool(appmod.DATABASE).close_all()
+
+        routes = build_routes(appmod)
+        selected = args.routes or list(routes)
+        unknown = [name for name in selected if name not in routes]
+        if unknown:
+            raise SystemExit(f"Unknown routes: {', '.join(unknown)} (choose from {', '.join(routes)})")
+
+        runs = []
+        for users in args.users:
+            print(f"users={users}", file=sys.stderr)
+            runs.append(run_size(appmod, routes, selected, users, args, workdir))
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "clients": args.clients,
+            "ippt_stub": not args.no_ippt,
+            "cold_cache": args.cold_cache,
+            "seed": args.seed,
+        },
+        "runs": runs,
+    }
+    text = json.dumps(report, indent=2) + "\n"
+    if args.output:
+        args.output.write_text(text)
+    else:
+        sys.stdout.write(text)
+
+
+if __name__ == "__main__":
+    main()
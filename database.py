@@ -0,0 +1,347 @@
+import atexit
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+import items
+
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+    # Negative cache_size is in KiB: roughly 16 MiB of page cache per connection.
+    "cache_size": -16000,
+    "mmap_size": 128 * 1024 * 1024,
+    "temp_store": "MEMORY",
+}
+
+
+class ConnectionPool:
+    """Long-lived, tuned SQLite connections shared across requests.
+
+    Each request checks out one connection and returns it on teardown, so the
+    pragmas, page cache and prepared statement cache survive between requests.
+    """
+
+    def __init__(self, path, max_idle=8, cached_statements=256, health_check_interval=30.0):
+        self.path = path
+        self.max_idle = max_idle
+        self.cached_statements = cached_statements
+        self.health_check_interval = health_check_interval
+        self._idle = []
+        self._lock = threading.Lock()
+        self._closed = False
+        self.created = 0
+
+    def _connect(self):
+        connection = sqlite3.connect(
+            self.path,
+            timeout=PRAGMAS["busy_timeout"] / 1000,
+            cached_statements=self.cached_statements,
+            check_same_thread=False,
+        )
+        connection.row_factory = sqlite3.Row
+        for name, value in PRAGMAS.items():
+            connection.execute(f"PRAGMA {name} = {value}")
+        self.created += 1
+        return connection
+
+    def healthy(self, connection):
+        try:
+            connection.execute("SELECT 1").fetchone()
+        except sqlite3.Error:
+            return False
+        return True
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                if self._closed:
+                    raise sqlite3.ProgrammingError("Connection pool is closed")
+                if not self._idle:
+                    break
+                connection, released_at = self._idle.pop()
+
+            if time.monotonic() - released_at < self.health_check_interval or self.healthy(connection):
+                return connection
+            connection.close()
+
+        return self._connect()
+
+    def release(self, connection):
+        if connection.in_transaction:
+            connection.rollback()
+
+        with self._lock:
+            if not self._closed and len(self._idle) < self.max_idle:
+                self._idle.append((connection, time.monotonic()))
+                return
+
+        connection.close()
+
+    def close_all(self):
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+
+        for connection, _ in idle:
+            connection.close()
+
+
+def _inventory_masks(connection):
+    connection.execute("ALTER TABLE profiles ADD COLUMN owned_mask INTEGER NOT NULL DEFAULT 0")
+    connection.execute("ALTER TABLE profiles ADD COLUMN equipped_mask INTEGER NOT NULL DEFAULT 0")
+
+    owned = defaultdict(list)
+    for row in connection.execute("SELECT user_id, item_path FROM owned_items"):
+        owned[row[0]].append(row[1])
+    equipped = defaultdict(list)
+    for row in connection.execute("SELECT user_id, item_path FROM equipped_items"):
+        equipped[row[0]].append(row[1])
+
+    updates = []
+    for user_id, avatar_path in connection.execute("SELECT user_id, avatar_path FROM profiles").fetchall():
+        equipped_keys = items.normalize_item_keys(equipped[user_id] or [avatar_path])
+        owned_keys = set(items.normalize_item_keys(owned[user_id])) | set(equipped_keys)
+        updates.append((items.mask_from_keys(owned_keys), items.mask_from_keys(equipped_keys), user_id))
+
+    connection.executemany(
+        "UPDATE profiles SET owned_mask = ?, equipped_mask = ? WHERE user_id = ?", updates
+    )
+    connection.execute("DROP TABLE owned_items")
+    connection.execute("DROP TABLE equipped_items")
+
+
+# Each entry moves the schema from PRAGMA user_version == index to index + 1,
+# either as an SQL script or as a function of the connection. Never edit a
+# migration that has shipped; append a new one instead.
+MIGRATIONS = [
+    # 1: baseline schema (matches databases created before migrations existed)
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        password TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS profiles (
+        user_id INTEGER PRIMARY KEY,
+        xp INTEGER DEFAULT 0,
+        credits INTEGER DEFAULT 0,
+        dob DATE,
+        goal TEXT,
+        avatar_path TEXT DEFAULT '/static/avatar/default.jpg',
+        next_ippt_date DATE,
+        prev_ippt_score INTEGER,
+        FOREIGN KEY(user_id) REFERENCES users(id)
+    );
+    CREATE TABLE IF NOT EXISTS workout_tracking (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        pushup INTEGER,
+        situp INTEGER,
+        run INTEGER,
+        score INTEGER,
+        date_submitted DATE,
+        FOREIGN KEY(user_id) REFERENCES users(id)
+    );
+    CREATE TABLE IF NOT EXISTS owned_items (
+        user_id INTEGER,
+        item_path TEXT,
+        PRIMARY KEY (user_id, item_path),
+        FOREIGN KEY(user_id) REFERENCES users(id)
+    );
+    CREATE TABLE IF NOT EXISTS equipped_items (
+        user_id INTEGER,
+        item_path TEXT,
+        PRIMARY KEY (user_id, item_path),
+        FOREIGN KEY(user_id) REFERENCES users(id)
+    );
+    """,
+    # 2: indexes for the leaderboard, tracker and dashboard queries, and one
+    # workout entry per user per day (keeping the newest duplicate)
+    """
+    CREATE INDEX IF NOT EXISTS idx_profiles_xp ON profiles (xp DESC, user_id);
+    DELETE FROM workout_tracking
+    WHERE id NOT IN (
+        SELECT MAX(id) FROM workout_tracking GROUP BY user_id, date_submitted
+    );
+    DROP INDEX IF EXISTS idx_workout_tracking_user_date;
+    CREATE UNIQUE INDEX IF NOT EXISTS ux_workout_tracking_user_date
+        ON workout_tracking (user_id, date_submitted);
+    """,
+    # 3: materialized per-user dashboard/shop summary, rebuilt on every write
+    """
+    CREATE TABLE IF NOT EXISTS user_summary (
+        user_id INTEGER PRIMARY KEY,
+        xp INTEGER NOT NULL,
+        level INTEGER NOT NULL,
+        tier TEXT NOT NULL,
+        latest_pushup INTEGER,
+        latest_situp INTEGER,
+        latest_run INTEGER,
+        latest_score INTEGER,
+        credits INTEGER NOT NULL,
+        owned_items TEXT NOT NULL,
+        equipped_items TEXT NOT NULL,
+        avatar_path TEXT NOT NULL,
+        FOREIGN KEY(user_id) REFERENCES users(id)
+    );
+    """,
+    # 4: owned/equipped items as bitmasks on the profile (bits follow SHOP_ITEM_ORDER)
+    _inventory_masks,
+    # 5: queue of raw workout submissions scored in the background (scoring.py)
+    """
+    CREATE TABLE IF NOT EXISTS workout_submissions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        pushup INTEGER NOT NULL,
+        situp INTEGER NOT NULL,
+        run INTEGER NOT NULL,
+        date_submitted DATE NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        score INTEGER,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at REAL NOT NULL DEFAULT 0,
+        error TEXT,
+        created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        completed_at TEXT,
+        FOREIGN KEY(user_id) REFERENCES users(id)
+    );
+    CREATE INDEX IF NOT EXISTS idx_workout_submissions_due
+        ON workout_submissions (next_attempt_at, id) WHERE status = 'pending';
+    CREATE INDEX IF NOT EXISTS idx_workout_submissions_user
+        ON workout_submissions (user_id, status, id);
+    """,
+    # 6: per-user XP by day, week and month for windowed leaderboards (rollups.py)
+    """
+    CREATE TABLE IF NOT EXISTS workout_rollups (
+        grain TEXT NOT NULL,
+        period DATE NOT NULL,
+        user_id INTEGER NOT NULL,
+        xp INTEGER NOT NULL DEFAULT 0,
+        workouts INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (grain, period, user_id),
+        FOREIGN KEY(user_id) REFERENCES users(id)
+    );
+    CREATE INDEX IF NOT EXISTS idx_workout_rollups_rank
+        ON workout_rollups (grain, period, xp DESC, user_id);
+    """,
+    # 7: XP awarded per workout row, so the rollups count resubmissions too.
+    # Resubmissions before this column existed kept only their last score, so
+    # the backfill counts each stored workout once.
+    """
+    ALTER TABLE workout_tracking ADD COLUMN xp INTEGER NOT NULL DEFAULT 0;
+    UPDATE workout_tracking SET xp = COALESCE(score, 0);
+    DELETE FROM workout_rollups;
+    INSERT INTO workout_rollups (grain, period, user_id, xp, workouts)
+    SELECT 'day', date_submitted AS period, user_id, SUM(xp), COUNT(*)
+    FROM workout_tracking GROUP BY period, user_id;
+    INSERT INTO workout_rollups (grain, period, user_id, xp, workouts)
+    SELECT 'week', date(date_submitted, 'weekday 0', '-6 days') AS period, user_id, SUM(xp), COUNT(*)
+    FROM workout_tracking GROUP BY period, user_id;
+    INSERT INTO workout_rollups (grain, period, user_id, xp, workouts)
+    SELECT 'month', date(date_submitted, 'start of month') AS period, user_id, SUM(xp), COUNT(*)
+    FROM workout_tracking GROUP BY period, user_id;
+    """,
+    # 8: the queued submission a workout row came from, so a retried older
+    # submission cannot overwrite a newer one for the same day
+    """
+    ALTER TABLE workout_tracking ADD COLUMN submission_id INTEGER;
+    UPDATE workout_tracking SET submission_id = (
+        SELECT MAX(id) FROM workout_submissions
+        WHERE workout_submissions.user_id = workout_tracking.user_id
+          AND workout_submissions.date_submitted = workout_tracking.date_submitted
+          AND workout_submissions.status = 'complete'
+    );
+    """,
+]
+
+
+# Values per IN (...) lookup. Two-column keys bind twice as many parameters,
+# which still stays below SQLite's historical limit of 999.
+IN_CHUNK = 250
+
+
+def select_in(connection, sql, values):
+    """Yield the rows of `sql` for all `values`, one IN (...) query per chunk.
+
+    `sql` marks the list with `{values}`. Tuples are bound as row values, e.g.
+    `WHERE (user_id, date_submitted) IN (VALUES {values})`; anything else is
+    bound as a single `?`.
+    """
+    values = list(values)
+    for start in range(0, len(values), IN_CHUNK):
+        chunk = values[start:start + IN_CHUNK]
+        if isinstance(chunk[0], tuple):
+            placeholder = "(" + ", ".join("?" * len(chunk[0])) + ")"
+            parameters = [part for value in chunk for part in value]
+        else:
+            placeholder = "?"
+            parameters = chunk
+        yield from connection.execute(sql.format(values=",".join([placeholder] * len(chunk))), parameters)
+
+
+def schema_version(connection):
+    return connection.execute("PRAGMA user_version").fetchone()[0]
+
+
+def _statements(script):
+    statement = ""
+    for part in script.split(";"):
+        statement += part + ";"
+        # complete_statement() keeps a trigger body's inner ';' together.
+        if sqlite3.complete_statement(statement):
+            if statement.strip(" \t\n;"):
+                yield statement
+            statement = ""
+
+
+def migrate(connection):
+    version = schema_version(connection)
+    if version >= len(MIGRATIONS):
+        return version
+
+    for target, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            # Another process (a second server worker, a CLI command) may have
+            # applied this step while we waited for the write lock.
+            if schema_version(connection) >= target:
+                connection.rollback()
+                continue
+            if callable(migration):
+                migration(connection)
+            else:
+                # Statement by statement: executescript() would commit first
+                # and give up the lock the version check relies on.
+                for statement in _statements(migration):
+                    connection.execute(statement)
+            connection.execute(f"PRAGMA user_version = {target}")
+            connection.commit()
+        except sqlite3.Error:
+            if connection.in_transaction:
+                connection.rollback()
+            raise
+
+    return len(MIGRATIONS)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(path):
+    with _pools_lock:
+        pool = _pools.get(path)
+        if pool is None:
+            pool = _pools[path] = ConnectionPool(path)
+        return pool
+
+
+@atexit.register
+def close_all_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close_all()
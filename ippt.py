@@ -0,0 +1,142 @@
+from array import array
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - score_many falls back to score()
+    np = None
+
+IPPT_API_URL = "https://ippt.vercel.app/api"
+
+# Local scoring is meant to be the source of truth, but the tables below have
+# not been checked against the official IPPT tables yet: PUSHUP_REPS repeats
+# SITUP_REPS and RUN_SECONDS is a straight line. Until they are, the app
+# scores through the IPPT API and never saves a score from these tables (see
+# ippt_score in app.py). To verify them, record the API's answers with
+# `flask record-ippt-answers` into RECORDED_ANSWERS, correct the tables until
+# tests/test_ippt.py passes against it, then set TABLES_VERIFIED.
+TABLES_VERIFIED = False
+RECORDED_ANSWERS = "tests/data/ippt_api_answers.json"
+
+# Upper bound of each age band; anyone older than the last bound is scored in it.
+AGE_BAND_LIMITS = [21, 24, 27, 30, 33, 36, 39, 42, 45, 48, 51, 54, 57, 60]
+
+# Minimum reps for 1..25 points in the youngest band. Each older band needs
+# one rep fewer per point value.
+PUSHUP_REPS = [
+    1, 5, 10, 15, 18, 20, 22, 24, 26, 28, 30, 32, 34,
+    36, 38, 40, 42, 44, 46, 48, 50, 53, 55, 57, 60,
+]
+SITUP_REPS = [
+    1, 5, 10, 15, 18, 20, 22, 24, 26, 28, 30, 32, 34,
+    36, 38, 40, 42, 44, 46, 48, 50, 53, 55, 57, 60,
+]
+
+# Slowest 2.4 km time (seconds) for 1..50 points in the youngest band. Each
+# older band is allowed 10 seconds more per point value.
+RUN_SECONDS = [1000 - 10 * step for step in range(50)]
+
+MAX_REPS = 100
+MAX_RUN_SECONDS = 1800
+RUN_SECONDS_STEP = 10
+
+
+def sweep_inputs(ages=None):
+    """Inputs that exercise every table entry, one station at a time.
+
+    The other two stations are held at values that score no points, and each
+    run time is checked on both sides of its 10 s slot boundary.
+    """
+    if ages is None:
+        ages = sorted({age for limit in AGE_BAND_LIMITS for age in (limit, limit + 1)})
+    for age in ages:
+        for reps in range(1, MAX_REPS + 1):
+            yield age, 0, reps, MAX_RUN_SECONDS + 1
+            yield age, reps, 0, MAX_RUN_SECONDS + 1
+        for run in range(0, MAX_RUN_SECONDS + 1, RUN_SECONDS_STEP):
+            yield age, 0, 0, run
+            yield age, 0, 0, run + 1
+
+
+def age_band(age):
+    for band, limit in enumerate(AGE_BAND_LIMITS):
+        if age <= limit:
+            return band
+    return len(AGE_BAND_LIMITS) - 1
+
+
+def _reps_table(thresholds, band):
+    table = array("B", bytes(MAX_REPS + 1))
+    for points, reps in enumerate(thresholds, start=1):
+        for count in range(max(1, reps - band), MAX_REPS + 1):
+            table[count] = points
+    return table
+
+
+def _run_table(thresholds, band):
+    # Indexed by ceil(seconds / 10); every 10 s slot maps to its points.
+    slots = MAX_RUN_SECONDS // RUN_SECONDS_STEP + 1
+    table = array("B", bytes(slots))
+    for points, limit in enumerate(thresholds, start=1):
+        last_slot = min(slots - 1, (limit + band * RUN_SECONDS_STEP) // RUN_SECONDS_STEP)
+        for slot in range(last_slot + 1):
+            table[slot] = points
+    return table
+
+
+PUSHUP_TABLES = [_reps_table(PUSHUP_REPS, band) for band in range(len(AGE_BAND_LIMITS))]
+SITUP_TABLES = [_reps_table(SITUP_REPS, band) for band in range(len(AGE_BAND_LIMITS))]
+RUN_TABLES = [_run_table(RUN_SECONDS, band) for band in range(len(AGE_BAND_LIMITS))]
+
+
+def station_points(age, situps, pushups, run):
+    band = age_band(age)
+    pushups = min(max(int(pushups), 0), MAX_REPS)
+    situps = min(max(int(situps), 0), MAX_REPS)
+    run_slot = -(-max(int(run), 0) // RUN_SECONDS_STEP)
+    run_points = RUN_TABLES[band][run_slot] if run_slot < len(RUN_TABLES[band]) else 0
+    return {
+        "pushups": PUSHUP_TABLES[band][pushups],
+        "situps": SITUP_TABLES[band][situps],
+        "run": run_points,
+    }
+
+
+def score(age, situps, pushups, run):
+    points = station_points(age, situps, pushups, run)
+    return points["pushups"] + points["situps"] + points["run"]
+
+
+def _stacked(tables):
+    return np.array([list(table) for table in tables], dtype=np.int16)
+
+
+_STACKED_TABLES = None
+
+
+def score_many(ages, situps, pushups, runs):
+    """Score equal-length sequences of results in one pass.
+
+    Same rules as score(); with numpy the band and table lookups run as array
+    indexing instead of one Python call per row.
+    """
+    global _STACKED_TABLES
+    if np is None:
+        return [score(*row) for row in zip(ages, situps, pushups, runs)]
+    if _STACKED_TABLES is None:
+        _STACKED_TABLES = (_stacked(PUSHUP_TABLES), _stacked(SITUP_TABLES), _stacked(RUN_TABLES))
+    pushup_tables, situp_tables, run_tables = _STACKED_TABLES
+
+    bands = np.minimum(
+        np.searchsorted(AGE_BAND_LIMITS, np.asarray(ages, dtype=np.int64), side="left"),
+        len(AGE_BAND_LIMITS) - 1,
+    )
+    pushups = np.clip(np.asarray(pushups, dtype=np.int64), 0, MAX_REPS)
+    situps = np.clip(np.asarray(situps, dtype=np.int64), 0, MAX_REPS)
+    run_slots = -(-np.maximum(np.asarray(runs, dtype=np.int64), 0) // RUN_SECONDS_STEP)
+    in_range = run_slots < run_tables.shape[1]
+    run_points = np.where(
+        in_range, run_tables[bands, np.minimum(run_slots, run_tables.shape[1] - 1)], 0
+    )
+
+    totals = pushup_tables[bands, pushups] + situp_tables[bands, situps] + run_points
+    return totals.tolist()
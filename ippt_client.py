@@ -0,0 +1,168 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import ippt
+
+
+class IPPTUnavailable(Exception):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            # Half-open: let a single probe through once the cool-down has passed.
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+
+class IPPTClient:
+    def __init__(
+        self,
+        base_url=ippt.IPPT_API_URL,
+        connect_timeout=1.0,
+        read_timeout=2.0,
+        cache_size=4096,
+        pool_size=10,
+        failure_threshold=5,
+        reset_timeout=30.0,
+        observer=None,
+    ):
+        self.base_url = base_url
+        # Called as observer(seconds, outcome) after every outbound request.
+        self.observer = observer
+        self.timeout = (connect_timeout, read_timeout)
+        self.cache_size = cache_size
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def cache_key(age, situps, pushups, run):
+        # Keyed on the exact inputs: this client is what the local tables are
+        # checked against, so it must not reuse their age bands or limits.
+        return int(age), int(situps), int(pushups), int(run)
+
+    def score(self, age, situps, pushups, run):
+        key = self.cache_key(age, situps, pushups, run)
+
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return self._cache[key]
+            self.misses += 1
+
+        total = self._fetch(key)
+
+        with self._lock:
+            self._cache[key] = total
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        return total
+
+    def score_many(self, rows, max_workers=8, budget=20.0):
+        """Totals for many (age, situps, pushups, run) rows, one request per distinct row.
+
+        Requests run on up to `max_workers` threads. Raises IPPTUnavailable as
+        soon as one fails, or when they are not all answered within `budget`
+        seconds, so a batch is either scored completely or not at all.
+        """
+        keys = [self.cache_key(*row) for row in rows]
+        distinct = list(dict.fromkeys(keys))
+        if not distinct:
+            return []
+        executor = ThreadPoolExecutor(min(max_workers, len(distinct)), thread_name_prefix="ippt")
+        try:
+            futures = {key: executor.submit(self.score, *key) for key in distinct}
+            done, pending = wait(futures.values(), timeout=budget, return_when=FIRST_EXCEPTION)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        for future in done:
+            if future.exception() is not None:
+                raise future.exception()
+        if pending:
+            raise IPPTUnavailable(
+                f"IPPT API answered {len(done)} of {len(distinct)} requests within {budget:g} s"
+            )
+        totals = {key: future.result() for key, future in futures.items()}
+        return [totals[key] for key in keys]
+
+    def _fetch(self, key):
+        if not self.breaker.allow():
+            raise IPPTUnavailable("IPPT API circuit is open")
+
+        age, situps, pushups, run = key
+        started = time.perf_counter()
+        try:
+            response = self.session.get(
+                self.base_url,
+                params={"age": age, "situps": situps, "pushups": pushups, "run": run},
+                timeout=self.timeout,
+            )
+            response.raise_for_status()
+            total = response.json()["total"]
+            # Checked before it reaches the cache, which would keep a bad
+            # answer until it is evicted.
+            if isinstance(total, bool) or not isinstance(total, int):
+                raise ValueError(f"unexpected total {total!r}")
+        except (requests.RequestException, ValueError, KeyError, TypeError) as exc:
+            self.breaker.record_failure()
+            self._observe(started, "error")
+            raise IPPTUnavailable(f"IPPT API request failed: {exc}") from exc
+
+        self.breaker.record_success()
+        self._observe(started, "ok")
+        return total
+
+    def _observe(self, started, outcome):
+        if self.observer is not None:
+            self.observer(time.perf_counter() - started, outcome)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,117 @@
+"""Local stand-in for the IPPT API, scored with the in-process tables.
+
+Run it with ``python ippt_stub.py --port 8765`` and point the app at it with
+``IPPT_API_URL=http://127.0.0.1:8765/api``.
+"""
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import ippt
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default listen backlog of 5 drops connections when clients fan out.
+    request_queue_size = 128
+
+
+class StubIPPTServer:
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, fail=False):
+        self.latency = latency
+        self.fail = fail
+        self.requests = 0
+        self._server = _Server((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/api"
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+
+                parsed = urlparse(self.path)
+                if parsed.path != "/api":
+                    self._send(404, {"error": "not found"})
+                    return
+                if stub.fail:
+                    self._send(503, {"error": "unavailable"})
+                    return
+
+                query = parse_qs(parsed.query)
+                try:
+                    args = [int(query[name][0]) for name in ("age", "situps", "pushups", "run")]
+                except (KeyError, ValueError):
+                    self._send(400, {"error": "age, situps, pushups and run are required"})
+                    return
+
+                points = ippt.station_points(*args)
+                self._send(200, {**points, "total": sum(points.values())})
+
+            def _send(self, status, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client gave up (e.g. hit its read timeout) before we answered.
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds to sleep per request")
+    parser.add_argument("--fail", action="store_true", help="answer every request with 503")
+    args = parser.parse_args()
+
+    server = StubIPPTServer(args.host, args.port, args.latency, args.fail)
+    print(f"Stub IPPT API listening on {server.url}")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+from collections import namedtuple
+from functools import lru_cache
+from itertools import combinations
+
+SHOP_ITEMS = [
+    {
+        "key": "headband",
+        "name": "Headband",
+        "desc": "Keeps sweat off",
+        "price": 50,
+        "category": "accessory",
+        "preview_image": "images/shop/items/headband.png",
+    },
+    {
+        "key": "headphones",
+        "name": "Headphones",
+        "desc": "Workout soundtrack",
+        "price": 180,
+        "category": "accessory",
+        "preview_image": "images/shop/items/headphones.png",
+    },
+    {
+        "key": "wristband",
+        "name": "Wristband",
+        "desc": "Grip & comfort",
+        "price": 60,
+        "category": "accessory",
+        "preview_image": "images/shop/items/wristband.png",
+    },
+    {
+        "key": "watch",
+        "name": "Sports Watch",
+        "desc": "Track your runs",
+        "price": 220,
+        "category": "accessory",
+        "preview_image": "images/shop/items/watch.png",
+    },
+    {
+        "key": "nikeshirt",
+        "name": "Nike T-Shirt",
+        "desc": "Classic training fit",
+        "price": 140,
+        "category": "top",
+        "preview_image": "images/shop/items/nikeshirt.png",
+    },
+    {
+        "key": "nikesinglet",
+        "name": "Nike Singlet",
+        "desc": "Light & breathable",
+        "price": 130,
+        "category": "top",
+        "preview_image": "images/shop/items/nikesinglet.png",
+    },
+]
+
+SHOP_ITEM_ORDER = [item["key"] for item in SHOP_ITEMS]
+SHOP_ITEM_BY_KEY = {item["key"]: item for item in SHOP_ITEMS}
+SHOP_ITEM_CATEGORIES = {item["key"]: item["category"] for item in SHOP_ITEMS}
+TOP_ITEM_KEYS = {
+    item["key"] for item in SHOP_ITEMS if item["category"] == "top"
+}
+ACCESSORY_ITEM_KEYS = [key for key in SHOP_ITEM_ORDER if key not in TOP_ITEM_KEYS]
+ITEM_KEY_ALIASES = {
+    "headband": "headband",
+    "headphones": "headphones",
+    "headphone": "headphones",
+    "wristband": "wristband",
+    "watch": "watch",
+    "nikeshirt": "nikeshirt",
+    "nikesinglet": "nikesinglet",
+}
+
+
+# Inventory is stored as integer bitmasks on the profile; bit i is SHOP_ITEM_ORDER[i].
+# Only ever append to SHOP_ITEMS so existing bits keep their meaning.
+ITEM_BITS = {key: 1 << index for index, key in enumerate(SHOP_ITEM_ORDER)}
+TOP_ITEMS_MASK = sum(ITEM_BITS[key] for key in TOP_ITEM_KEYS)
+
+DEFAULT_AVATAR_FILENAME = "avatar/default.jpg"
+COMBINATIONS_DIR = "avatar/combinations"
+# Widths of the WebP variants written next to each full-size PNG.
+AVATAR_WIDTHS = (320, 640, 1024)
+
+ItemCombination = namedtuple("ItemCombination", "keys mask name filename avatar_path srcset")
+
+
+def variant_filename(name, width):
+    return f"{COMBINATIONS_DIR}/{name}-{width}.webp"
+
+
+def _build_combination(keys):
+    keys = tuple(key for key in SHOP_ITEM_ORDER if key in keys)
+    name = "__".join(keys)
+    filename = f"{COMBINATIONS_DIR}/{name}.png" if keys else DEFAULT_AVATAR_FILENAME
+    srcset = ", ".join(
+        f"/static/{variant_filename(name, width)} {width}w" for width in AVATAR_WIDTHS
+    ) if keys else ""
+    return ItemCombination(keys, mask_from_keys(keys), name, filename, "/static/" + filename, srcset)
+
+
+def _valid_combinations():
+    # Any set of accessories, plus at most one top.
+    for top_key in [None, *sorted(TOP_ITEM_KEYS, key=SHOP_ITEM_ORDER.index)]:
+        for count in range(len(ACCESSORY_ITEM_KEYS) + 1):
+            for accessory_keys in combinations(ACCESSORY_ITEM_KEYS, count):
+                yield _build_combination(accessory_keys + ((top_key,) if top_key else ()))
+
+
+def mask_from_keys(item_keys):
+    mask = 0
+    for key in item_keys:
+        mask |= ITEM_BITS[key]
+    return mask
+
+
+# Every avatar the shop can produce, built once at import. The empty
+# combination is the default avatar.
+ITEM_COMBINATIONS = list(_valid_combinations())
+COMBINATION_BY_MASK = {combo.mask: combo for combo in ITEM_COMBINATIONS}
+DEFAULT_COMBINATION = COMBINATION_BY_MASK[0]
+
+# Reverse index from every canonical spelling of a combination (item key,
+# alias, "a__b" name, file name, static path, shop preview image) to its keys.
+COMBINATION_BY_PATH = {}
+for _combo in ITEM_COMBINATIONS:
+    if not _combo.keys:
+        continue
+    for _value in (
+        _combo.name,
+        _combo.name + ".png",
+        _combo.filename,
+        _combo.avatar_path,
+        "/" + _combo.filename,
+    ):
+        COMBINATION_BY_PATH[_value] = _combo
+
+_VALUE_KEYS = {value: list(combo.keys) for value, combo in COMBINATION_BY_PATH.items()}
+for _alias, _key in ITEM_KEY_ALIASES.items():
+    _VALUE_KEYS.setdefault(_alias, [_key])
+for _item in SHOP_ITEMS:
+    _VALUE_KEYS[_item["preview_image"]] = [_item["key"]]
+    _VALUE_KEYS["/static/" + _item["preview_image"]] = [_item["key"]]
+del _combo, _value, _alias, _key, _item
+
+
+@lru_cache(maxsize=1024)
+def _parse_item_keys(raw_value):
+    filename = raw_value.rsplit("/", 1)[-1]
+    stem = filename.rsplit(".", 1)[0]
+    if "__" in stem:
+        return tuple(
+            ITEM_KEY_ALIASES[item_key]
+            for item_key in stem.split("__")
+            if item_key in ITEM_KEY_ALIASES
+        )
+
+    item_key = ITEM_KEY_ALIASES.get(stem)
+    return (item_key,) if item_key else ()
+
+
+def item_keys_from_value(value):
+    if not value:
+        return []
+
+    raw_value = str(value).replace("\\", "/").lower()
+    keys = _VALUE_KEYS.get(raw_value)
+    if keys is not None:
+        return list(keys)
+    return list(_parse_item_keys(raw_value))
+
+
+def normalize_item_key(value):
+    keys = item_keys_from_value(value)
+    return keys[0] if keys else None
+
+
+def combination_for_items(values):
+    # Later tops replace earlier ones, matching how the shop equips items.
+    mask = 0
+    for value in values or []:
+        for key in item_keys_from_value(value):
+            mask = equip_item(mask, key)
+    return COMBINATION_BY_MASK[mask]
+
+
+def normalize_item_keys(values):
+    return list(combination_for_items(values).keys)
+
+
+def avatar_filename_for_items(item_keys):
+    return combination_for_items(item_keys).filename
+
+
+def avatar_path_for_items(item_keys):
+    return combination_for_items(item_keys).avatar_path
+
+
+def avatar_srcset_for_items(item_keys):
+    # WebP srcset for the same avatar as avatar_path_for_items(); empty for
+    # the default avatar, which has no variants.
+    return combination_for_items(item_keys).srcset
+
+
+def keys_from_mask(mask):
+    return [key for key in SHOP_ITEM_ORDER if mask & ITEM_BITS[key]]
+
+
+def has_item(mask, item_key):
+    return bool(mask & ITEM_BITS[item_key])
+
+
+def add_item(mask, item_key):
+    return mask | ITEM_BITS[item_key]
+
+
+def equip_item(equipped_mask, item_key):
+    # Only one top can be worn at a time, so equipping a top replaces the other.
+    if item_key in TOP_ITEM_KEYS:
+        equipped_mask &= ~TOP_ITEMS_MASK
+    return equipped_mask | ITEM_BITS[item_key]
@@ -0,0 +1,277 @@
+"""Opt-in request metrics in the Prometheus text format.
+
+Records per-endpoint latency histograms, counts and times every SQL
+statement a request runs (through the sqlite3 trace and progress callbacks
+plus a thin timing wrapper around the request's connection), times outbound
+IPPT calls, and logs slow requests together with the SQL that ran.
+"""
+
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from flask import Response, g, has_request_context, request
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+STATEMENT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+logger = logging.getLogger(__name__)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, *labels):
+        with self._lock:
+            self._values[labels] += amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    label_text = _labels(self.labelnames, labels, [("le", _number(bound))])
+                    lines.append(f"{self.name}_bucket{label_text} {cumulative}")
+                label_text = _labels(self.labelnames, labels)
+                lines.append(f"{self.name}_sum{label_text} {_number(total)}")
+                lines.append(f"{self.name}_count{label_text} {count}")
+        return lines
+
+
+class RequestStats:
+    __slots__ = ("started", "statements", "vm_steps", "queries", "sql_seconds", "ippt_calls", "status")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.statements = 0
+        self.vm_steps = 0
+        self.queries = []
+        self.sql_seconds = 0.0
+        self.ippt_calls = []
+        self.status = None
+
+
+class TracedConnection:
+    """Times each call the request makes on its pooled connection.
+
+    sqlite3 has no end-of-statement callback, so durations are measured around
+    execute/executemany/executescript/commit; rows fetched afterwards are not
+    included. Everything else is passed straight through.
+    """
+
+    def __init__(self, connection, metrics, stats):
+        self._connection = connection
+        self._metrics = metrics
+        self._stats = stats
+
+    def _timed(self, method, sql, *args):
+        started = time.perf_counter()
+        try:
+            return getattr(self._connection, method)(*args)
+        finally:
+            elapsed = time.perf_counter() - started
+            self._stats.queries.append((sql, elapsed))
+            self._stats.sql_seconds += elapsed
+            self._metrics.sql_duration.observe(elapsed, request.endpoint or "unmatched")
+
+    def execute(self, sql, parameters=()):
+        return self._timed("execute", sql, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._timed("executemany", sql, sql, seq_of_parameters)
+
+    def executescript(self, script):
+        return self._timed("executescript", script, script)
+
+    def commit(self):
+        return self._timed("commit", "COMMIT")
+
+    def rollback(self):
+        return self._timed("rollback", "ROLLBACK")
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+
+class Metrics:
+    def __init__(self, slow_request_seconds=0.5, progress_steps=100, slow_query_count=5):
+        self.slow_request_seconds = slow_request_seconds
+        self.progress_steps = progress_steps
+        self.slow_query_count = slow_query_count
+
+        self.request_duration = Histogram(
+            "http_request_duration_seconds", "Request latency by endpoint.",
+            ("endpoint", "method", "status"),
+        )
+        self.statements_per_request = Histogram(
+            "sqlite_statements_per_request", "SQL statements run per request.",
+            ("endpoint",), STATEMENT_BUCKETS,
+        )
+        self.statements = Counter(
+            "sqlite_statements_total", "SQL statements run, from the sqlite3 trace callback.", ("endpoint",)
+        )
+        self.vm_steps = Counter(
+            "sqlite_vm_steps_total", "Approximate SQLite VM instructions, from the progress handler.",
+            ("endpoint",),
+        )
+        self.sql_duration = Histogram(
+            "sqlite_call_duration_seconds", "Duration of each execute/commit call.", ("endpoint",), SQL_BUCKETS
+        )
+        self.ippt_duration = Histogram(
+            "ippt_request_duration_seconds", "Outbound IPPT API call duration.", ("outcome",)
+        )
+        self.slow_requests = Counter(
+            "http_slow_requests_total", "Requests slower than the slow-request threshold.", ("endpoint",)
+        )
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        app.add_url_rule("/metrics", "metrics", self.render_response)
+
+    def trace(self, connection):
+        """Instrument a connection checked out for the current request."""
+        stats = g.get("_request_metrics") if has_request_context() else None
+        if stats is None:
+            return connection
+
+        def count_statement(statement):
+            stats.statements += 1
+
+        def count_steps():
+            stats.vm_steps += self.progress_steps
+            return 0
+
+        connection.set_trace_callback(count_statement)
+        connection.set_progress_handler(count_steps, self.progress_steps)
+        return TracedConnection(connection, self, stats)
+
+    def untrace(self, connection):
+        connection.set_trace_callback(None)
+        connection.set_progress_handler(None, self.progress_steps)
+
+    def observe_ippt(self, seconds, outcome):
+        self.ippt_duration.observe(seconds, outcome)
+        if has_request_context():
+            stats = g.get("_request_metrics")
+            if stats is not None:
+                stats.ippt_calls.append((outcome, seconds))
+
+    def _before_request(self):
+        g._request_metrics = RequestStats()
+
+    def _after_request(self, response):
+        stats = g.get("_request_metrics")
+        if stats is not None:
+            stats.status = response.status_code
+        return response
+
+    def _teardown_request(self, exception):
+        stats = g.pop("_request_metrics", None)
+        if stats is None or request.endpoint == "metrics":
+            return
+        elapsed = time.perf_counter() - stats.started
+        endpoint = request.endpoint or "unmatched"
+        status = stats.status if exception is None and stats.status is not None else 500
+
+        self.request_duration.observe(elapsed, endpoint, request.method, str(status))
+        self.statements_per_request.observe(stats.statements, endpoint)
+        self.statements.inc(stats.statements, endpoint)
+        self.vm_steps.inc(stats.vm_steps, endpoint)
+
+        if elapsed >= self.slow_request_seconds:
+            self.slow_requests.inc(1, endpoint)
+            self._log_slow_request(elapsed, endpoint, status, stats)
+
+    def _log_slow_request(self, elapsed, endpoint, status, stats):
+        # Group identical SQL so N+1 patterns show up as one line with a count.
+        grouped = defaultdict(lambda: [0, 0.0])
+        for sql, seconds in stats.queries:
+            entry = grouped[" ".join(sql.split())]
+            entry[0] += 1
+            entry[1] += seconds
+        slowest = sorted(grouped.items(), key=lambda item: item[1][1], reverse=True)[:self.slow_query_count]
+        ippt_seconds = sum(seconds for _, seconds in stats.ippt_calls)
+
+        lines = [
+            f"Slow request {request.method} {request.path} ({endpoint}) -> {status} in {elapsed * 1000:.1f} ms: "
+            f"{stats.statements} statements, {stats.sql_seconds * 1000:.1f} ms in SQL, "
+            f"{len(stats.ippt_calls)} IPPT calls ({ippt_seconds * 1000:.1f} ms)"
+        ]
+        for sql, (count, seconds) in slowest:
+            lines.append(f"  {seconds * 1000:8.2f} ms  x{count:<4} {sql[:300]}")
+        logger.warning("\n".join(lines))
+
+    def render(self):
+        lines = []
+        for metric in (
+            self.request_duration,
+            self.slow_requests,
+            self.statements,
+            self.statements_per_request,
+            self.vm_steps,
+            self.sql_duration,
+            self.ippt_duration,
+        ):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def render_response(self):
+        return Response(self.render(), mimetype=None, content_type=PROMETHEUS_CONTENT_TYPE)
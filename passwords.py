@@ -0,0 +1,126 @@
+"""Password hashing off the request threads.
+
+Werkzeug's password hashes are deliberately slow, CPU-bound work. Running
+them in a request thread holds the GIL long enough that a burst of logins
+slows every other page. PasswordHasher runs them in a small process pool
+instead. Admission is bounded: at most `max_workers + max_queue` jobs may be
+running or waiting, and anything past that raises HasherBusy straight away
+so the view can answer 503 instead of piling up behind the pool.
+
+verify() also reports when a stored hash uses different parameters than the
+configured method, and returns a fresh hash. The caller can save it, so
+accounts move to the tuned parameters as their owners log in.
+"""
+
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# Werkzeug's default, spelled out so stored hashes can be compared against it.
+DEFAULT_METHOD = "scrypt:32768:8:1"
+
+
+class HasherBusy(Exception):
+    """The hashing pool is full or did not answer in time; retry shortly."""
+
+
+def hash_method(hashed):
+    return hashed.split("$", 1)[0]
+
+
+def _hash(password, method):
+    return generate_password_hash(password, method)
+
+
+def _verify(hashed, password, method_prefix, method):
+    if not check_password_hash(hashed, password):
+        return False, None
+    if hash_method(hashed) != method_prefix:
+        return True, generate_password_hash(password, method)
+    return True, None
+
+
+class PasswordHasher:
+    def __init__(self, method=DEFAULT_METHOD, max_workers=2, max_queue=16, timeout=10.0, start_method=None):
+        self.method = method
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._executor = None
+        self._method_prefix = None
+        self._lock = threading.Lock()
+        # fork avoids re-importing the app in every worker; spawn covers
+        # platforms without it.
+        if start_method is None:
+            start_method = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+        self._context = multiprocessing.get_context(start_method)
+
+    def start(self):
+        """Start the workers now, before the server starts its threads.
+
+        Only forked pools are started early: forking a process that already
+        runs request threads can copy a lock some other thread holds. Other
+        start methods start the pool on first use.
+        """
+        if self.max_workers > 0 and self._context.get_start_method() == "fork":
+            # A forked pool launches all of its workers on the first submit.
+            self._get_executor().submit(int).result()
+        return self
+
+    @property
+    def method_prefix(self):
+        # "scrypt" is stored as "scrypt:32768:8:1"; hash once to learn the
+        # exact prefix new hashes get, which also validates the method.
+        if self._method_prefix is None:
+            self._method_prefix = hash_method(generate_password_hash("", self.method))
+        return self._method_prefix
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(self.max_workers, mp_context=self._context)
+            return self._executor
+
+    def _run(self, function, *args):
+        if self.max_workers <= 0:
+            return function(*args)
+
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy("Too many password checks in progress")
+        try:
+            executor = self._get_executor()
+            future = executor.submit(function, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        # The slot is held until the job really finishes, even if we stop waiting.
+        future.add_done_callback(lambda _: self._slots.release())
+
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            raise HasherBusy("Password check timed out") from None
+        except BrokenProcessPool:
+            # A worker died; start a fresh pool for the next request.
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            executor.shutdown(wait=False)
+            raise HasherBusy("Password hashing pool restarted") from None
+
+    def hash(self, password):
+        return self._run(_hash, password, self.method)
+
+    def verify(self, hashed, password):
+        """Return (valid, new_hash); new_hash is set when the hash should be upgraded."""
+        return self._run(_verify, hashed, password, self.method_prefix, self.method)
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
@@ -0,0 +1,92 @@
+"""Per-user XP totals by day, ISO week and month.
+
+workout_rollups holds one row per (grain, period, user) with the XP awarded
+for the workouts recorded in that period. Every submission awards its score
+as XP, including a resubmission that replaces the day's workout, and
+workout_tracking.xp keeps that running total per row, like profiles.xp does
+per user. Every write to workout_tracking passes the XP it awarded to
+record_workouts, which adjusts all three grains in the same transaction, so
+a windowed leaderboard reads one index range instead of grouping the whole
+workout history. rebuild() recomputes the table from workout_tracking.
+"""
+
+from datetime import date, timedelta
+
+from database import select_in
+
+GRAINS = ("day", "week", "month")
+
+# Same period starts as period_starts(), in SQLite date functions.
+_PERIOD_SQL = {
+    "day": "date_submitted",
+    "week": "date(date_submitted, 'weekday 0', '-6 days')",
+    "month": "date(date_submitted, 'start of month')",
+}
+
+
+def period_starts(day):
+    """Start date of the day, week (Monday) and month containing `day`."""
+    if isinstance(day, str):
+        day = date.fromisoformat(day)
+    return {
+        "day": day.isoformat(),
+        "week": (day - timedelta(days=day.weekday())).isoformat(),
+        "month": day.replace(day=1).isoformat(),
+    }
+
+
+def stored_workouts(db, keys):
+    """Map the (user_id, date_submitted) pairs that have a workout row to its submission_id."""
+    return {
+        (row["user_id"], row["date_submitted"]): row["submission_id"]
+        for row in select_in(
+            db,
+            """
+            SELECT user_id, date_submitted, submission_id FROM workout_tracking
+            WHERE (user_id, date_submitted) IN (VALUES {values})
+            """,
+            keys,
+        )
+    }
+
+
+def record_workouts(db, workouts):
+    """Apply workout writes to the rollups inside the caller's transaction.
+
+    `workouts` yields (user_id, date_submitted, xp, new) where xp is the XP
+    the write awarded and new is true when it created the workout_tracking
+    row rather than replacing that day's workout.
+    """
+    deltas = {}
+    for user_id, day, xp, new in workouts:
+        added = 1 if new else 0
+        for grain, period in period_starts(day).items():
+            entry = deltas.setdefault((grain, period, user_id), [0, 0])
+            entry[0] += xp
+            entry[1] += added
+
+    db.executemany(
+        """
+        INSERT INTO workout_rollups (grain, period, user_id, xp, workouts)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (grain, period, user_id) DO UPDATE SET
+            xp = xp + excluded.xp,
+            workouts = workouts + excluded.workouts
+        """,
+        [(*key, xp, added) for key, (xp, added) in deltas.items()],
+    )
+
+
+def rebuild(db):
+    """Recompute every rollup from workout_tracking; the caller commits."""
+    db.execute("DELETE FROM workout_rollups")
+    for grain in GRAINS:
+        db.execute(
+            f"""
+            INSERT INTO workout_rollups (grain, period, user_id, xp, workouts)
+            SELECT ?, {_PERIOD_SQL[grain]} AS period, user_id, COALESCE(SUM(xp), 0), COUNT(*)
+            FROM workout_tracking
+            GROUP BY period, user_id
+            """,
+            (grain,),
+        )
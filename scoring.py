@@ -0,0 +1,216 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from database import get_pool
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+COMPLETE = "complete"
+FAILED = "failed"
+
+
+class ScoringWorker:
+    """Scores queued workout submissions on a bounded thread pool.
+
+    Submissions live in the workout_submissions table, so the queue survives
+    restarts and a slow scorer only grows the table instead of holding request
+    threads. A dispatcher thread claims due submissions up to the pool size;
+    each one is scored outside any transaction, then its XP and credits are
+    applied and the submission is marked complete in one write transaction.
+    Failures are retried with exponential backoff until max_attempts.
+
+    `score(db, submission)` returns the score, `apply(db, submission, score)`
+    writes its effects inside the transaction, and `on_complete(user_id)` runs
+    after commit. Exceptions listed in `transient` (e.g. the scorer being
+    unreachable) never use up the last attempt: the submission stays pending
+    and is retried every `max_backoff` seconds until it can be scored.
+    """
+
+    def __init__(
+        self,
+        database_path,
+        score,
+        apply,
+        on_complete=None,
+        max_workers=2,
+        max_attempts=5,
+        backoff=1.0,
+        max_backoff=60.0,
+        poll_interval=5.0,
+        transient=(),
+    ):
+        self.database_path = database_path
+        self.score = score
+        self.apply = apply
+        self.on_complete = on_complete
+        self.max_workers = max_workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.poll_interval = poll_interval
+        self.transient = tuple(transient)
+        self._executor = None
+        self._dispatcher = None
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._in_flight = set()
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._dispatcher is not None:
+                return self
+            self._stopping.clear()
+            self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="scoring")
+            self._dispatcher = threading.Thread(target=self._dispatch, name="scoring-dispatcher", daemon=True)
+            self._dispatcher.start()
+        return self
+
+    def stop(self, wait=True):
+        with self._lock:
+            dispatcher, self._dispatcher = self._dispatcher, None
+            executor, self._executor = self._executor, None
+        if dispatcher is None:
+            return
+        self._stopping.set()
+        self._wake.set()
+        dispatcher.join()
+        executor.shutdown(wait=wait)
+
+    def notify(self):
+        self.start()
+        self._wake.set()
+
+    def enqueue(self, db, user_id, pushup, situp, run, date_submitted):
+        """Insert a pending submission on the caller's connection; the caller commits."""
+        cursor = db.execute(
+            """
+            INSERT INTO workout_submissions (user_id, pushup, situp, run, date_submitted, status)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (user_id, pushup, situp, run, date_submitted, PENDING),
+        )
+        return cursor.lastrowid
+
+    def _dispatch(self):
+        while not self._stopping.is_set():
+            self._wake.clear()
+            try:
+                self._claim_due()
+            except Exception:
+                logger.exception("Scoring dispatcher failed to read the queue")
+            self._wake.wait(self.poll_interval)
+
+    def _claim_due(self):
+        with self._lock:
+            free = self.max_workers - len(self._in_flight)
+            in_flight = list(self._in_flight)
+        if free <= 0:
+            return
+
+        pool = get_pool(self.database_path)
+        db = pool.acquire()
+        try:
+            placeholders = ",".join("?" * len(in_flight))
+            excluded = f"AND id NOT IN ({placeholders})" if in_flight else ""
+            rows = db.execute(
+                f"""
+                SELECT id FROM workout_submissions
+                WHERE status = ? AND next_attempt_at <= ? {excluded}
+                ORDER BY next_attempt_at, id
+                LIMIT ?
+                """,
+                (PENDING, time.time(), *in_flight, free),
+            ).fetchall()
+        finally:
+            pool.release(db)
+
+        for row in rows:
+            with self._lock:
+                if self._executor is None:
+                    return
+                self._in_flight.add(row["id"])
+                executor = self._executor
+            executor.submit(self._run, row["id"])
+
+    def _run(self, submission_id):
+        try:
+            self.process(submission_id)
+        except Exception:
+            logger.exception("Scoring submission %s crashed", submission_id)
+        finally:
+            with self._lock:
+                self._in_flight.discard(submission_id)
+            # A slot is free again; pick up anything else that is due.
+            self._wake.set()
+
+    def process(self, submission_id, db=None):
+        """Score one submission now. Returns its status afterwards.
+
+        Pass `db` to run on a connection the caller already holds, e.g. a
+        request's own (traced) connection; it must not be in a transaction.
+        Otherwise a pooled connection is used.
+        """
+        pool = None
+        if db is None:
+            pool = get_pool(self.database_path)
+            db = pool.acquire()
+        try:
+            submission = db.execute(
+                "SELECT * FROM workout_submissions WHERE id = ?", (submission_id,)
+            ).fetchone()
+            if submission is None or submission["status"] != PENDING:
+                return submission["status"] if submission else None
+
+            try:
+                score = self.score(db, submission)
+                db.execute("BEGIN IMMEDIATE")
+                # Another process may have finished it while we were scoring.
+                claimed = db.execute(
+                    """
+                    UPDATE workout_submissions
+                    SET status = ?, score = ?, attempts = attempts + 1, error = NULL,
+                        completed_at = CURRENT_TIMESTAMP
+                    WHERE id = ? AND status = ?
+                    """,
+                    (COMPLETE, score, submission_id, PENDING),
+                ).rowcount
+                if claimed:
+                    self.apply(db, submission, score)
+                db.commit()
+            except Exception as exc:
+                if db.in_transaction:
+                    db.rollback()
+                return self._retry_later(db, submission, exc)
+        finally:
+            if pool is not None:
+                pool.release(db)
+
+        if claimed and self.on_complete:
+            self.on_complete(submission["user_id"])
+        return COMPLETE
+
+    def _retry_later(self, db, submission, exc):
+        attempts = submission["attempts"] + 1
+        if attempts >= self.max_attempts and not isinstance(exc, self.transient):
+            status, next_attempt_at = FAILED, 0
+            logger.error("Giving up on submission %s after %s attempts: %s", submission["id"], attempts, exc)
+        else:
+            delay = min(self.max_backoff, self.backoff * 2 ** (attempts - 1))
+            status, next_attempt_at = PENDING, time.time() + delay * random.uniform(0.5, 1.0)
+            logger.warning("Submission %s failed (attempt %s), retrying: %s", submission["id"], attempts, exc)
+
+        db.execute(
+            """
+            UPDATE workout_submissions
+            SET status = ?, attempts = ?, next_attempt_at = ?, error = ?
+            WHERE id = ? AND status = ?
+            """,
+            (status, attempts, next_attempt_at, str(exc)[:500], submission["id"], PENDING),
+        )
+        db.commit()
+        return status
@@ -1,190 +1,276 @@
-from itertools import combinations
+import argparse
+import json
+import os
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
-from PIL import Image, ImageChops, ImageFilter
-
+from PIL import Image
 
 ROOT = Path(__file__).resolve().parents[1]
 AVATAR_DIR = ROOT / "static" / "avatar"
 OUTPUT_DIR = AVATAR_DIR / "combinations"
+MANIFEST_NAME = "manifest.json"
+
+# The app's item registry is the single source of truth for which
+# combinations exist and what their files are called.
+sys.path.insert(0, str(ROOT))
+import items  # noqa: E402
+from avatar import (  # noqa: E402
+    ITEMS,
+    LAYER_MANIFEST_NAME,
+    LAYER_ORDER,
+    LAYERS_DIR,
+    RENDER_VERSION,
+    combo_hash,
+    composite_combination,
+    cropped_layer,
+    encode_avatar,
+    encode_sprite,
+    file_hash,
+    item_hashes,
+    load_layer_manifest,
+    selected_component_mask,
+)
+
+ITEM_ORDER = items.SHOP_ITEM_ORDER
+
+TOP_ITEMS = [key for key in ITEM_ORDER if key in items.TOP_ITEM_KEYS]
+ACCESSORY_ITEMS = items.ACCESSORY_ITEM_KEYS
 
-ITEM_ORDER = [
-    "headband",
-    "headphones",
-    "wristband",
-    "watch",
-    "nikeshirt",
-    "nikesinglet",
-]
-
-LAYER_ORDER = [
-    "nikeshirt",
-    "nikesinglet",
-    "headband",
-    "headphones",
-    "wristband",
-    "watch",
-]
-
-TOP_ITEMS = ["nikeshirt", "nikesinglet"]
-ACCESSORY_ITEMS = ["headband", "headphones", "wristband", "watch"]
-
-ITEMS = {
-    "headband": {
-        "source": "headband.png",
-        "threshold": 55,
-        "focus": (430, 50, 590, 155),
-        "min_area": 20,
-    },
-    "headphones": {
-        "source": "headphone.png",
-        "threshold": 55,
-        "focus": (410, 40, 620, 210),
-        "min_area": 20,
-    },
-    "wristband": {
-        "source": "wristband.png",
-        "threshold": 55,
-        "focus": (340, 450, 430, 570),
-        "min_area": 20,
-    },
-    "watch": {
-        "source": "watch.png",
-        "threshold": 55,
-        "focus": (610, 425, 685, 575),
-        "min_area": 20,
-    },
-    "nikeshirt": {
-        "source": "nikeshirt.png",
-        "threshold": 55,
-        "focus": (360, 210, 665, 420),
-        "min_area": 400,
-    },
-    "nikesinglet": {
-        "source": "nikesinglet.png",
-        "threshold": 55,
-        "focus": (360, 210, 640, 420),
-        "min_area": 200,
-    },
-}
-
-
-def intersects(first, second):
-    ax1, ay1, ax2, ay2 = first
-    bx1, by1, bx2, by2 = second
-    return ax1 < bx2 and ax2 > bx1 and ay1 < by2 and ay2 > by1
-
-
-def changed_pixel_mask(base, image, threshold):
-    diff = ImageChops.difference(base, image)
-    width, height = diff.size
-    diff_pixels = diff.load()
-    mask = bytearray(width * height)
-
-    for y in range(height):
-        row = y * width
-        for x in range(width):
-            if max(diff_pixels[x, y]) > threshold:
-                mask[row + x] = 1
-
-    return mask, width, height
-
-
-def selected_component_mask(base, image, config):
-    mask, width, height = changed_pixel_mask(base, image, config["threshold"])
-    seen = bytearray(width * height)
-    selected = Image.new("L", (width, height), 0)
-    selected_pixels = selected.load()
-
-    for idx, value in enumerate(mask):
-        if not value or seen[idx]:
-            continue
-
-        stack = [idx]
-        seen[idx] = 1
-        pixels = []
-        min_x = width
-        min_y = height
-        max_x = 0
-        max_y = 0
-
-        while stack:
-            current = stack.pop()
-            pixels.append(current)
-            x = current % width
-            y = current // width
-            min_x = min(min_x, x)
-            min_y = min(min_y, y)
-            max_x = max(max_x, x)
-            max_y = max(max_y, y)
-
-            for next_y in (y - 1, y, y + 1):
-                if next_y < 0 or next_y >= height:
-                    continue
-                for next_x in (x - 1, x, x + 1):
-                    if next_x < 0 or next_x >= width or (next_x == x and next_y == y):
-                        continue
-                    next_idx = next_y * width + next_x
-                    if mask[next_idx] and not seen[next_idx]:
-                        seen[next_idx] = 1
-                        stack.append(next_idx)
-
-        bbox = (min_x, min_y, max_x + 1, max_y + 1)
-        if len(pixels) < config["min_area"] or not intersects(bbox, config["focus"]):
-            continue
 
-        for pixel_idx in pixels:
-            selected_pixels[pixel_idx % width, pixel_idx // width] = 255
-
-    return selected.filter(ImageFilter.MaxFilter(9)).filter(ImageFilter.GaussianBlur(1.2))
+def combo_filename(keys):
+    return items.combination_for_items(keys).name + ".png"
 
 
-def combo_filename(keys):
-    ordered = [key for key in ITEM_ORDER if key in keys]
-    return "__".join(ordered) + ".png"
+def variant_filenames(keys):
+    name = items.combination_for_items(keys).name
+    return [f"{name}-{width}.webp" for width in items.AVATAR_WIDTHS]
 
 
 def valid_combinations():
-    for top_item in [None, *TOP_ITEMS]:
-        for count in range(len(ACCESSORY_ITEMS) + 1):
-            for accessory_keys in combinations(ACCESSORY_ITEMS, count):
-                keys = list(accessory_keys)
-                if top_item:
-                    keys.append(top_item)
-                if keys:
-                    yield [key for key in ITEM_ORDER if key in keys]
-
-
-def main():
-    base = Image.open(AVATAR_DIR / "default.jpg").convert("RGB")
-    sources = {
-        key: Image.open(AVATAR_DIR / config["source"]).convert("RGB")
-        for key, config in ITEMS.items()
+    for combo in items.ITEM_COMBINATIONS:
+        if combo.keys:
+            yield list(combo.keys)
+
+
+def load_manifest(output_dir):
+    try:
+        return json.loads((output_dir / MANIFEST_NAME).read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def atomic_write(path, write):
+    # Write to a temp file in the same directory, then rename over the target,
+    # so the app never serves a half-written file.
+    handle, temp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    os.close(handle)
+    try:
+        write(temp_path)
+        # mkstemp creates files as 0600; published assets must be world-readable.
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        Path(temp_path).unlink(missing_ok=True)
+        raise
+
+
+def compute_layer(avatar_dir, key):
+    base = Image.open(avatar_dir / "default.jpg").convert("RGB")
+    source = Image.open(avatar_dir / ITEMS[key]["source"]).convert("RGB")
+    return key, cropped_layer(source, selected_component_mask(base, source, ITEMS[key]))
+
+
+_worker = {}
+
+
+def init_worker(avatar_dir, layers):
+    _worker["base"] = Image.open(avatar_dir / "default.jpg").convert("RGBA")
+    _worker["layers"] = layers
+
+
+def render_combination(keys, output_dir):
+    image = composite_combination(_worker["base"], _worker["layers"], keys)
+    filename = combo_filename(keys)
+    atomic_write(output_dir / filename, lambda temp_path: image.save(temp_path, format="PNG", optimize=True))
+    for width, variant in zip(items.AVATAR_WIDTHS, variant_filenames(keys)):
+        data = encode_avatar(image, width)
+        atomic_write(output_dir / variant, lambda temp_path: Path(temp_path).write_bytes(data))
+    return filename
+
+
+def static_src(path):
+    return path.relative_to(ROOT / "static").as_posix() if path.is_relative_to(ROOT / "static") else path.name
+
+
+def export_layers(avatar_dir, layers_dir, layers, base_hash, hashes, force=False):
+    """Write the base image and one cropped alpha sprite per item, plus a
+    manifest with each sprite's offset and z-order for stacking in the browser.
+
+    Only sprites whose item hash changed are re-encoded. Returns the number of
+    files written.
+    """
+    previous = None if force else load_layer_manifest(layers_dir)
+    previous_layers = previous["layers"] if previous and previous["base"]["hash"] == base_hash else {}
+    layers_dir.mkdir(parents=True, exist_ok=True)
+    written = 0
+
+    base_path = layers_dir / "base.webp"
+    base = Image.open(avatar_dir / "default.jpg")
+    if not previous_layers or not base_path.exists():
+        data = encode_sprite(base.convert("RGB"))
+        atomic_write(base_path, lambda temp_path: Path(temp_path).write_bytes(data))
+        written += 1
+
+    entries = {}
+    for z, key in enumerate(LAYER_ORDER):
+        sprite_path = layers_dir / f"{key}.webp"
+        entry = previous_layers.get(key)
+        if entry and entry["hash"] == hashes[key] and sprite_path.exists():
+            entries[key] = entry
+            continue
+        if layers.get(key) is None:
+            sprite_path.unlink(missing_ok=True)
+            continue
+        (x, y), sprite = layers[key]
+        data = encode_sprite(sprite)
+        atomic_write(sprite_path, lambda temp_path: Path(temp_path).write_bytes(data))
+        written += 1
+        entries[key] = {
+            "src": static_src(sprite_path),
+            "hash": hashes[key],
+            "x": x,
+            "y": y,
+            "width": sprite.width,
+            "height": sprite.height,
+            "z": z,
+        }
+
+    manifest = {
+        "render_version": RENDER_VERSION,
+        "base": {
+            "src": static_src(base_path),
+            "hash": base_hash,
+            "width": base.width,
+            "height": base.height,
+        },
+        "layers": entries,
     }
-    masks = {
-        key: selected_component_mask(base, sources[key], config)
-        for key, config in ITEMS.items()
+    atomic_write(
+        layers_dir / LAYER_MANIFEST_NAME,
+        lambda temp_path: Path(temp_path).write_text(json.dumps(manifest, indent=2, sort_keys=True) + "\n"),
+    )
+    return written
+
+
+def stale_layer_keys(layers_dir, base_hash, hashes, force=False):
+    previous = None if force else load_layer_manifest(layers_dir)
+    if not previous or previous["base"]["hash"] != base_hash:
+        return list(ITEM_ORDER)
+    entries = previous["layers"]
+    return [
+        key for key in ITEM_ORDER
+        if key not in entries
+        or entries[key]["hash"] != hashes[key]
+        or not (layers_dir / f"{key}.webp").exists()
+    ]
+
+
+def run_jobs(jobs, function, args_list, initializer=None, initargs=()):
+    if jobs == 1:
+        if initializer:
+            initializer(*initargs)
+        return [function(*args) for args in args_list]
+
+    with ProcessPoolExecutor(max_workers=jobs, initializer=initializer, initargs=initargs) as pool:
+        futures = [pool.submit(function, *args) for args in args_list]
+        return [future.result() for future in futures]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate pre-rendered avatar item combinations.")
+    parser.add_argument("--avatar-dir", type=Path, default=AVATAR_DIR, help="directory with default.jpg and item sources")
+    parser.add_argument("--output-dir", type=Path, default=OUTPUT_DIR)
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="worker processes (1 runs inline)")
+    parser.add_argument("--layers-dir", type=Path, default=LAYERS_DIR, help="where to write the base and item sprites")
+    parser.add_argument("--skip-combinations", action="store_true", help="only export sprites for client-side stacking")
+    parser.add_argument("--force", action="store_true", help="rebuild every combination and sprite")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    avatar_dir = args.avatar_dir
+    output_dir = args.output_dir
+    jobs = max(1, args.jobs)
+
+    missing = [key for key in ITEM_ORDER if key not in ITEMS or key not in LAYER_ORDER]
+    if missing:
+        raise SystemExit(f"Add ITEMS and LAYER_ORDER entries for: {', '.join(missing)}")
+
+    base_hash = file_hash(avatar_dir / "default.jpg")
+    hashes = item_hashes(avatar_dir)
+    manifest = {} if args.force else load_manifest(output_dir)
+    previous = manifest.get("combinations", {})
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    wanted = {}
+    outputs = set()
+    stale = []
+    for keys in [] if args.skip_combinations else valid_combinations():
+        filename = combo_filename(keys)
+        files = [filename, *variant_filenames(keys)]
+        outputs.update(files)
+        wanted[filename] = combo_hash(keys, base_hash, hashes)
+        if previous.get(filename) != wanted[filename] or not all((output_dir / name).exists() for name in files):
+            stale.append(keys)
+
+    if not args.skip_combinations:
+        for old_file in [*output_dir.glob("*.png"), *output_dir.glob("*.webp")]:
+            if old_file.name not in outputs:
+                old_file.unlink()
+
+    stale_sprites = stale_layer_keys(args.layers_dir, base_hash, hashes, args.force)
+    needed = [
+        key for key in ITEM_ORDER
+        if key in stale_sprites or any(key in keys for keys in stale)
+    ]
+    layers = dict(run_jobs(jobs, compute_layer, [(avatar_dir, key) for key in needed]))
+
+    if stale:
+        run_jobs(
+            jobs,
+            render_combination,
+            [(keys, output_dir) for keys in stale],
+            initializer=init_worker,
+            initargs=(avatar_dir, layers),
+        )
+
+    sprites = 0
+    if stale_sprites:
+        sprites = export_layers(avatar_dir, args.layers_dir, layers, base_hash, hashes, args.force)
+
+    if args.skip_combinations:
+        print(f"Exported {sprites} avatar sprites to {args.layers_dir}")
+        return
+
+    manifest = {
+        "render_version": RENDER_VERSION,
+        "base": base_hash,
+        "items": hashes,
+        "combinations": wanted,
     }
-
-    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-    for old_file in OUTPUT_DIR.glob("*.png"):
-        old_file.unlink()
-
-    generated = 0
-    for keys in valid_combinations():
-        composite = base.convert("RGBA")
-
-        for key in LAYER_ORDER:
-            if key not in keys:
-                continue
-            layer = sources[key].convert("RGBA")
-            layer.putalpha(masks[key])
-            composite = Image.alpha_composite(composite, layer)
-
-        composite.convert("RGB").save(OUTPUT_DIR / combo_filename(keys), optimize=True)
-        generated += 1
-
-    print(f"Generated {generated} avatar combinations in {OUTPUT_DIR}")
+    atomic_write(
+        output_dir / MANIFEST_NAME,
+        lambda temp_path: Path(temp_path).write_text(json.dumps(manifest, indent=2, sort_keys=True) + "\n"),
+    )
+
+    print(
+        f"Generated {len(stale)} of {len(wanted)} avatar combinations in {output_dir} "
+        f"({len(wanted) - len(stale)} up to date); exported {sprites} sprites to {args.layers_dir}"
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,35 @@
+import json
+from pathlib import Path
+
+import pytest
+
+import ippt
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def recorded_answers():
+    path = ROOT / ippt.RECORDED_ANSWERS
+    if not path.exists():
+        return None
+    return json.loads(path.read_text())["answers"]
+
+
+def test_tables_match_recorded_api_answers():
+    answers = recorded_answers()
+    if answers is None:
+        # Scores from unverified tables must never be what the app saves.
+        assert not ippt.TABLES_VERIFIED, f"TABLES_VERIFIED needs {ippt.RECORDED_ANSWERS}"
+        pytest.skip(f"no recorded API answers; run `flask record-ippt-answers` to create {ippt.RECORDED_ANSWERS}")
+
+    swept = {tuple(key) for *key, _ in answers}
+    assert swept >= set(ippt.sweep_inputs(sorted({age for age, *_ in answers})))
+    mismatches = [
+        (key, total, ippt.score(*key)) for *key, total in answers if ippt.score(*key) != total
+    ]
+    assert not mismatches, f"{len(mismatches)} answers differ, first: {mismatches[:5]}"
+
+
+def test_score_many_matches_score():
+    rows = list(ippt.sweep_inputs())
+    assert ippt.score_many(*zip(*rows)) == [ippt.score(*row) for row in rows]
@@ -0,0 +1,67 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import ippt
+from ippt_client import IPPTClient, IPPTUnavailable
+from ippt_stub import StubIPPTServer
+
+
+@pytest.fixture
+def api():
+    """An API that answers with the queued payloads, one per request."""
+    answers = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = json.dumps(answers.pop(0)).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/api", answers
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize("payload", [{"total": None}, {"total": "60"}, {"total": 60.5}, {"total": True}, [60], {}])
+def test_invalid_totals_are_not_cached(api, payload):
+    url, answers = api
+    client = IPPTClient(url, failure_threshold=100)
+    answers.extend([payload, {"total": 60}])
+
+    with pytest.raises(IPPTUnavailable):
+        client.score(25, 40, 40, 660)
+    assert client.score(25, 40, 40, 660) == 60
+    assert client.score(25, 40, 40, 660) == 60
+    assert client.hits == 1
+
+
+def test_score_many_fans_out_and_keeps_row_order():
+    rows = [(25, situps, 30, 700) for situps in range(20)] * 2
+    with StubIPPTServer(latency=0.05) as stub:
+        client = IPPTClient(stub.url)
+        started = time.perf_counter()
+        totals = client.score_many(rows, max_workers=8)
+        elapsed = time.perf_counter() - started
+        assert stub.requests == 20
+    assert totals == [ippt.score(*row) for row in rows]
+    assert elapsed < 20 * 0.05
+
+
+def test_score_many_gives_up_after_its_budget():
+    with StubIPPTServer(latency=0.5) as stub:
+        client = IPPTClient(stub.url)
+        with pytest.raises(IPPTUnavailable, match="within"):
+            client.score_many([(25, situps, 30, 700) for situps in range(8)], max_workers=2, budget=0.2)
@@ -0,0 +1,95 @@
+import sqlite3
+
+import pytest
+
+import database
+import items
+
+
+def connect(path):
+    connection = sqlite3.connect(path)
+    connection.row_factory = sqlite3.Row
+    return connection
+
+
+@pytest.fixture
+def baseline_path(tmp_path):
+    """A database as the app created it before migrations existed (user_version 0)."""
+    path = tmp_path / "baseline.db"
+    connection = connect(path)
+    connection.executescript(database.MIGRATIONS[0])
+    connection.executescript("""
+        INSERT INTO users (id, username, password) VALUES (1, 'alice', 'x'), (2, 'bob', 'x');
+        INSERT INTO profiles (user_id, xp, credits, dob, avatar_path)
+        VALUES (1, 150, 20, '2000-01-01', '/static/avatar/combinations/headband__watch.png'),
+               (2, 0, 0, '1995-06-01', '/static/avatar/default.jpg');
+        INSERT INTO workout_tracking (user_id, pushup, situp, run, score, date_submitted)
+        VALUES (1, 30, 30, 700, 50, '2026-10-12'),
+               (1, 40, 40, 650, 60, '2026-10-12'),
+               (1, 20, 20, 800, 40, '2026-10-13');
+        INSERT INTO owned_items (user_id, item_path) VALUES (1, 'headband'), (1, 'watch'), (1, 'nikeshirt');
+        INSERT INTO equipped_items (user_id, item_path) VALUES (1, 'headband'), (1, 'watch');
+    """)
+    connection.close()
+    return path
+
+
+def table_names(connection):
+    return {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+
+def test_upgrades_baseline_database(baseline_path):
+    connection = connect(baseline_path)
+    assert database.schema_version(connection) == 0
+
+    assert database.migrate(connection) == len(database.MIGRATIONS)
+    assert database.schema_version(connection) == len(database.MIGRATIONS)
+
+    # Same-day duplicates collapse to the newest entry.
+    workouts = connection.execute(
+        "SELECT date_submitted, score FROM workout_tracking WHERE user_id = 1 ORDER BY date_submitted"
+    ).fetchall()
+    assert [tuple(row) for row in workouts] == [("2026-10-12", 60), ("2026-10-13", 40)]
+
+    # Inventory tables become bitmasks on the profile.
+    profile = connection.execute("SELECT owned_mask, equipped_mask FROM profiles WHERE user_id = 1").fetchone()
+    assert profile["owned_mask"] == items.mask_from_keys(["headband", "watch", "nikeshirt"])
+    assert profile["equipped_mask"] == items.mask_from_keys(["headband", "watch"])
+    assert not {"owned_items", "equipped_items"} & table_names(connection)
+    assert {"user_summary", "workout_submissions", "workout_rollups"} <= table_names(connection)
+
+    # Rollups are backfilled from the surviving workouts (both days share a week).
+    week = connection.execute(
+        "SELECT period, xp, workouts FROM workout_rollups WHERE grain = 'week' AND user_id = 1"
+    ).fetchall()
+    assert [tuple(row) for row in week] == [("2026-10-12", 100, 2)]
+
+
+def test_migrate_is_a_no_op_when_current(baseline_path):
+    connection = connect(baseline_path)
+    database.migrate(connection)
+    database.migrate(connection)
+    assert database.schema_version(connection) == len(database.MIGRATIONS)
+
+
+def test_stale_version_does_not_replay_applied_migrations(baseline_path, monkeypatch):
+    first = connect(baseline_path)
+    second = connect(baseline_path)
+    database.migrate(first)
+
+    # The second process read user_version before the first one migrated.
+    real_schema_version = database.schema_version
+    calls = []
+
+    def stale_then_real(connection):
+        calls.append(connection)
+        return 0 if len(calls) == 1 else real_schema_version(connection)
+
+    monkeypatch.setattr(database, "schema_version", stale_then_real)
+    assert database.migrate(second) == len(database.MIGRATIONS)
+    monkeypatch.undo()
+
+    assert database.schema_version(second) == len(database.MIGRATIONS)
+    assert database.migrate(connect(baseline_path)) == len(database.MIGRATIONS)
+    rows = second.execute("SELECT COUNT(*) FROM workout_tracking WHERE user_id = 1").fetchone()[0]
+    assert rows == 2
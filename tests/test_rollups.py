@@ -0,0 +1,59 @@
+import sqlite3
+
+import pytest
+
+import database
+import rollups
+from workout_import import import_workouts
+
+
+@pytest.fixture
+def db(tmp_path):
+    connection = sqlite3.connect(tmp_path / "app.db")
+    connection.row_factory = sqlite3.Row
+    database.migrate(connection)
+    connection.executescript("""
+        INSERT INTO users (id, username, password) VALUES (1, 'alice', 'x');
+        INSERT INTO profiles (user_id, xp, credits, dob) VALUES (1, 0, 0, '2000-01-01');
+    """)
+    connection.commit()
+    return connection
+
+
+def award(db, xp_by_user):
+    for user_id, xp in xp_by_user.items():
+        db.execute("UPDATE profiles SET xp = xp + ? WHERE user_id = ?", (xp, user_id))
+
+
+def rollup_rows(db):
+    return [tuple(row) for row in db.execute(
+        "SELECT grain, period, user_id, xp, workouts FROM workout_rollups ORDER BY grain, period"
+    )]
+
+
+def test_resubmissions_count_towards_the_rollups(db):
+    scores = iter([50, 30, 40])
+
+    def score_many(ages, situps, pushups, runs):
+        return [next(scores) for _ in ages]
+
+    for day in ("2026-10-12", "2026-10-12", "2026-10-13"):
+        row = {"username": "alice", "date": day, "pushups": 30, "situps": 30, "run": 700}
+        import_workouts(db, [row], award, score_many=score_many)
+
+    profile_xp = db.execute("SELECT xp FROM profiles WHERE user_id = 1").fetchone()[0]
+    week = db.execute(
+        "SELECT xp, workouts FROM workout_rollups WHERE grain = 'week' AND user_id = 1"
+    ).fetchone()
+    assert profile_xp == 120
+    assert tuple(week) == (120, 2)
+
+    # The day's row keeps the latest workout but all of the XP it awarded.
+    day = db.execute(
+        "SELECT score, xp FROM workout_tracking WHERE user_id = 1 AND date_submitted = '2026-10-12'"
+    ).fetchone()
+    assert tuple(day) == (30, 80)
+
+    incremental = rollup_rows(db)
+    rollups.rebuild(db)
+    assert rollup_rows(db) == incremental
@@ -0,0 +1,237 @@
+"""Bulk import of a unit's workout results from CSV or JSON.
+
+Each row is validated and matched to its user first. All valid rows are then
+scored in one batch call and written with executemany inside one write
+transaction, together with their rollups. XP and credits are
+applied once per user, for the sum of that user's rows. Rows that fail
+validation are never written; they come back in the report with the reason.
+"""
+
+import csv
+import io
+import json
+from datetime import date, datetime
+
+import ippt
+import rollups
+from database import select_in
+
+FIELDS = ("username", "date", "pushups", "situps", "run")
+FORMATS = ("csv", "json")
+
+
+def detect_format(filename=None, mimetype=None):
+    name = (filename or "").lower()
+    if name.endswith(".json") or (mimetype or "").endswith("json"):
+        return "json"
+    if name.endswith(".csv") or (mimetype or "") in ("text/csv", "application/csv", "text/plain"):
+        return "csv"
+    return None
+
+
+def parse_workout_file(data, format):
+    """Return the file's rows as dicts with lower-cased keys.
+
+    Raises ValueError when the file itself cannot be read; problems with
+    individual rows are left for import_workouts to report.
+    """
+    if format not in FORMATS:
+        raise ValueError(f"Unknown format {format!r}; use csv or json")
+    if isinstance(data, bytes):
+        try:
+            data = data.decode("utf-8-sig")
+        except UnicodeDecodeError as exc:
+            raise ValueError("File is not UTF-8 text") from exc
+
+    if format == "json":
+        try:
+            payload = json.loads(data)
+        except json.JSONDecodeError as exc:
+            raise ValueError(f"Invalid JSON: {exc}") from exc
+        if isinstance(payload, dict):
+            payload = payload.get("workouts")
+        if not isinstance(payload, list):
+            raise ValueError('Expected a list of workouts or {"workouts": [...]}')
+        return [
+            {str(key).strip().lower(): value for key, value in row.items()} if isinstance(row, dict) else row
+            for row in payload
+        ]
+
+    reader = csv.DictReader(io.StringIO(data))
+    if not reader.fieldnames:
+        raise ValueError("CSV file is empty")
+    reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+    missing = [name for name in FIELDS if name not in reader.fieldnames]
+    if missing:
+        raise ValueError(f"CSV header is missing: {', '.join(missing)}")
+    return list(reader)
+
+
+def parse_run(value):
+    """Run time in seconds, from an int or an "MM:SS" string."""
+    if isinstance(value, str) and ":" in value:
+        minutes, _, seconds = value.strip().partition(":")
+        try:
+            minutes, seconds = int(minutes), int(seconds)
+        except ValueError:
+            raise ValueError("run must be seconds or MM:SS") from None
+        if minutes < 0 or not 0 <= seconds < 60:
+            raise ValueError("run must be seconds or MM:SS")
+        return minutes * 60 + seconds
+    return _count(value, "run")
+
+
+def _count(value, field):
+    if isinstance(value, bool):
+        raise ValueError(f"{field} must be a whole number")
+    if isinstance(value, str):
+        value = value.strip()
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{field} must be a whole number") from None
+    if number < 0:
+        raise ValueError(f"{field} cannot be negative")
+    return number
+
+
+def validate_row(raw, today):
+    if not isinstance(raw, dict):
+        raise ValueError("row must be an object")
+    username = str(raw.get("username") or "").strip()
+    if not username:
+        raise ValueError("username is required")
+    try:
+        day = datetime.strptime(str(raw.get("date") or "").strip(), "%Y-%m-%d").date()
+    except ValueError:
+        raise ValueError("date must be YYYY-MM-DD") from None
+    if day > today:
+        raise ValueError("date is in the future")
+    run = parse_run(raw.get("run"))
+    if run == 0:
+        raise ValueError("run must be greater than zero")
+    return {
+        "username": username,
+        "date": day.isoformat(),
+        "year": day.year,
+        "pushup": _count(raw.get("pushups"), "pushups"),
+        "situp": _count(raw.get("situps"), "situps"),
+        "run": run,
+    }
+
+
+def _lookup_users(db, usernames):
+    rows = select_in(
+        db,
+        """
+        SELECT users.id, users.username, profiles.dob
+        FROM users LEFT JOIN profiles ON profiles.user_id = users.id
+        WHERE users.username IN ({values})
+        """,
+        usernames,
+    )
+    return {row["username"]: row for row in rows}
+
+
+def import_workouts(db, rows, award, score_many=ippt.score_many, today=None):
+    """Validate, score and write rows; returns the per-row report.
+
+    `score_many(ages, situps, pushups, runs)` returns one score per row, and
+    `award(db, xp_by_user)` applies the summed scores to each user's profile
+    inside the import transaction.
+    """
+    today = today or date.today()
+    report = [{"row": number, "status": "error"} for number in range(1, len(rows) + 1)]
+    valid = []
+    seen = {}
+
+    for entry, raw in zip(report, rows):
+        try:
+            row = validate_row(raw, today)
+        except ValueError as exc:
+            if isinstance(raw, dict) and raw.get("username"):
+                entry["username"] = str(raw["username"]).strip()
+            entry["error"] = str(exc)
+            continue
+        entry["username"] = row["username"]
+        entry["date"] = row["date"]
+        key = (row["username"], row["date"])
+        if key in seen:
+            entry["error"] = f"duplicate of row {seen[key]}"
+            continue
+        seen[key] = entry["row"]
+        valid.append((entry, row))
+
+    users = _lookup_users(db, {row["username"] for _, row in valid})
+    scored = []
+    for entry, row in valid:
+        user = users.get(row["username"])
+        if user is None:
+            entry["error"] = "unknown username"
+        elif not user["dob"]:
+            entry["error"] = "user has not completed onboarding"
+        else:
+            row["user_id"] = user["id"]
+            # Age as of the workout, by the same year difference /workout uses.
+            row["age"] = row["year"] - int(user["dob"][:4])
+            scored.append((entry, row))
+
+    if not scored:
+        return report
+
+    scores = score_many(
+        [row["age"] for _, row in scored],
+        [row["situp"] for _, row in scored],
+        [row["pushup"] for _, row in scored],
+        [row["run"] for _, row in scored],
+    )
+
+    xp_by_user = {}
+    for (entry, row), score in zip(scored, scores):
+        row["score"] = score
+        xp_by_user[row["user_id"]] = xp_by_user.get(row["user_id"], 0) + score
+
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        existing = rollups.stored_workouts(db, [(row["user_id"], row["date"]) for _, row in scored])
+        db.executemany(
+            """
+            INSERT INTO workout_tracking (user_id, pushup, situp, run, score, date_submitted, xp, submission_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, (SELECT MAX(id) FROM workout_submissions))
+            ON CONFLICT (user_id, date_submitted) DO UPDATE SET
+                pushup = excluded.pushup,
+                situp = excluded.situp,
+                run = excluded.run,
+                score = excluded.score,
+                submission_id = excluded.submission_id,
+                xp = workout_tracking.xp + excluded.xp
+            """,
+            [
+                (row["user_id"], row["pushup"], row["situp"], row["run"], row["score"], row["date"], row["score"])
+                for _, row in scored
+            ],
+        )
+        rollups.record_workouts(db, [
+            (row["user_id"], row["date"], row["score"], (row["user_id"], row["date"]) not in existing)
+            for _, row in scored
+        ])
+        award(db, xp_by_user)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    for entry, row in scored:
+        entry["status"] = "imported"
+        entry["score"] = row["score"]
+    return report
+
+
+def summarize(report):
+    imported = sum(1 for entry in report if entry["status"] == "imported")
+    return {
+        "imported": imported,
+        "failed": len(report) - imported,
+        "users": len({entry["username"] for entry in report if entry["status"] == "imported"}),
+        "rows": report,
+    }